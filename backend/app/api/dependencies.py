@@ -1,6 +1,9 @@
 """Dependency injection for FastAPI routes."""
 
-from functools import lru_cache
+from functools import cache
+from typing import Annotated
+
+from fastapi import Depends
 
 from app.domain.services.history_service import HistoryService
 from app.domain.services.search_service import SearchService
@@ -11,14 +14,14 @@ from app.utils.logger import logger
 
 
 # Infrastructure dependencies (singletons)
-@lru_cache()
+@cache
 def get_language_model() -> LanguageModel:
     """Get the language model instance (singleton)."""
     logger.debug("Getting language model instance")
     return LanguageModel()
 
 
-@lru_cache()
+@cache
 def get_db() -> SpaceDB:
     """Get the database instance (singleton)."""
     logger.debug("Getting database instance")
@@ -26,29 +29,51 @@ def get_db() -> SpaceDB:
     return SpaceDB(lm)
 
 
-# Service dependencies (cached to ensure singleton behavior)
-@lru_cache()
-def get_sources_service() -> SourcesService:
-    """Get the sources service instance (singleton)."""
-    logger.debug("Getting sources service instance")
+# Service singletons (cached to ensure singleton behavior)
+@cache
+def _create_sources_service() -> SourcesService:
+    """Create the sources service instance (singleton)."""
+    logger.debug("Creating sources service instance")
     db = get_db()
     return SourcesService(db=db)
 
 
-@lru_cache()
-def get_history_service() -> HistoryService:
-    """Get the history service instance (singleton)."""
-    logger.debug("Getting history service instance")
+@cache
+def _create_history_service() -> HistoryService:
+    """Create the history service instance (singleton)."""
+    logger.debug("Creating history service instance")
     db = get_db()
     return HistoryService(db=db)
 
 
-@lru_cache()
-def get_search_service() -> SearchService:
-    """Get the search service instance (singleton)."""
-    logger.debug("Getting search service instance")
+@cache
+def _create_search_service() -> SearchService:
+    """Create the search service instance (singleton)."""
+    logger.debug("Creating search service instance")
     db = get_db()
     lm = get_language_model()
-    history_service = get_history_service()
+    history_service = _create_history_service()
     return SearchService(db=db, lm=lm, history_service=history_service)
 
+
+# Service dependencies (async so FastAPI resolves them on the event loop instead of the threadpool)
+async def get_sources_service() -> SourcesService:
+    """Get the sources service instance (singleton)."""
+    return _create_sources_service()
+
+
+async def get_history_service() -> HistoryService:
+    """Get the history service instance (singleton)."""
+    return _create_history_service()
+
+
+async def get_search_service() -> SearchService:
+    """Get the search service instance (singleton)."""
+    return _create_search_service()
+
+
+# Annotated dependency types for controllers. Each is a single, flat Depends() on an async provider
+# returning a cached singleton, so FastAPI has no sub-dependencies to solve per request.
+SourcesServiceDep = Annotated[SourcesService, Depends(get_sources_service)]
+HistoryServiceDep = Annotated[HistoryService, Depends(get_history_service)]
+SearchServiceDep = Annotated[SearchService, Depends(get_search_service)]
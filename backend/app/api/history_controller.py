@@ -1,13 +1,12 @@
 """Controller for handling history-related API endpoints."""
 
-from typing import List
+from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, HTTPException, Query, status
 from fastapi.responses import Response
 
-from app.api.dependencies import get_history_service
-from app.domain.models import HistoryResponse, SearchResult
-from app.domain.services.history_service import HistoryService
+from app.api.dependencies import HistoryServiceDep
+from app.domain.models import HistoryResponse, PaginationParams, SearchResult
 from app.utils.logger import logger
 
 
@@ -19,37 +18,49 @@ class HistoryController:
         logger.info("Initializing HistoryController")
         self.router = APIRouter(prefix="/api", tags=["history"])
 
-        # Register routes
-        self.router.get("/history", response_model=HistoryResponse)(self.get_history)
-        self.router.get("/history/{history_id}/results", response_model=List[SearchResult])(self.get_history_results)
+        # Register routes (response_model=None: services already return validated models)
+        self.router.get("/history", response_model=None,
+                        responses={200: {"model": HistoryResponse}})(self.get_history)
+        self.router.get("/history/{history_id}/results", response_model=None,
+                        responses={200: {"model": List[SearchResult]}})(self.get_history_results)
         self.router.delete("/history/{history_id}")(self.delete_history_item)
 
     @staticmethod
-    def get_history(
-            startIndex: int = Query(0, description="Starting index for pagination", ge=0),
-            limit: int = Query(10, description="Number of items per page", ge=1, le=100),
-            history_service: HistoryService = Depends(get_history_service)
+    async def get_history(
+            params: Annotated[PaginationParams, Query()],
+            history_service: HistoryServiceDep
     ) -> HistoryResponse:
         """
         Get paginated search history.
 
         Args:
-            startIndex: Starting index for pagination (default: 0)
-            limit: Maximum number of items to return (default: 10, max: 100)
+            params: Pagination query parameters - startIndex (default: 0), limit (default: 10, max: 100)
+                    and cursor (next_cursor of the previous page, takes precedence over startIndex)
             history_service: Injected history service
 
         Returns:
-            HistoryResponse containing paginated items and total count
+            HistoryResponse containing paginated items, total count and next_cursor
+
+        Raises:
+            400: If the cursor is malformed
         """
-        logger.info(f"Getting history: startIndex={startIndex}, limit={limit}")
-        response = history_service.get_history(start_index=startIndex, limit=limit)
-        logger.info(f"Returning {len(response.items)} items (total: {response.total})")
+        logger.info("Getting history: startIndex=%s, limit=%s, cursor=%s",
+                    params.startIndex, params.limit, params.cursor)
+        try:
+            response = history_service.get_history(start_index=params.startIndex, limit=params.limit,
+                                                   cursor=params.cursor)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        logger.info("Returning %s items (total: %s)", len(response.items), response.total)
         return response
 
     @staticmethod
-    def get_history_results(
+    async def get_history_results(
             history_id: str,
-            history_service: HistoryService = Depends(get_history_service)
+            history_service: HistoryServiceDep
     ) -> List[SearchResult]:
         """
         Get the full search results for a specific history item.
@@ -64,10 +75,10 @@ class HistoryController:
         Raises:
             404: If the history item is not found
         """
-        logger.info(f"Getting history results for ID: {history_id}")
+        logger.info("Getting history results for ID: %s", history_id)
         try:
             results = history_service.get_history_results(history_id)
-            logger.info(f"Returning {len(results)} results for history ID: {history_id}")
+            logger.info("Returning %s results for history ID: %s", len(results), history_id)
             return results
         except ValueError as e:
             raise HTTPException(
@@ -76,9 +87,9 @@ class HistoryController:
             )
 
     @staticmethod
-    def delete_history_item(
+    async def delete_history_item(
             history_id: str,
-            history_service: HistoryService = Depends(get_history_service)
+            history_service: HistoryServiceDep
     ) -> Response:
         """
         Delete a specific history item by ID.
@@ -90,7 +101,7 @@ class HistoryController:
         Returns:
             204 No Content if successful, 404 if not found
         """
-        logger.info(f"Deleting history item: {history_id}")
+        logger.info("Deleting history item: %s", history_id)
         deleted = history_service.delete_history_item(history_id)
 
         if not deleted:
@@ -99,5 +110,5 @@ class HistoryController:
                 detail=f"History item with ID {history_id} not found"
             )
 
-        logger.info(f"Successfully deleted history item: {history_id}")
+        logger.info("Successfully deleted history item: %s", history_id)
         return Response(status_code=status.HTTP_204_NO_CONTENT)
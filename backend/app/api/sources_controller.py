@@ -2,11 +2,11 @@
 
 from typing import List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Request, Response, status
 
-from app.api.dependencies import get_sources_service
+from app.api.dependencies import SourcesServiceDep
 from app.domain.models import Source
-from app.domain.services.sources_service import SourcesService
+from app.utils.constants import SOURCES_CACHE_CONTROL
 from app.utils.logger import logger
 
 
@@ -17,22 +17,30 @@ class SourcesController:
         """Initialize the SourcesController."""
         logger.info("Initializing SourcesController")
         self.router = APIRouter(prefix="/api", tags=["sources"])
-        self.router.get("/sources", response_model=List[Source])(self.get_sources)
+        self.router.get("/sources", response_model=None,
+                        responses={200: {"model": List[Source]}})(self.get_sources)
 
     @staticmethod
-    def get_sources(
-            sources_service: SourcesService = Depends(get_sources_service)
-    ) -> List[Source]:
+    async def get_sources(request: Request, sources_service: SourcesServiceDep) -> Response:
         """
         Retrieve all NASA image sources.
 
+        The sources never change while the app runs, so the encoded JSON body is cached and served as is.
+        The response carries an ETag; a request whose If-None-Match matches it gets 304 Not Modified.
+
         Args:
+            request: The incoming request (for the If-None-Match header)
             sources_service: Injected sources service
 
         Returns:
-            List of all available sources
+            The JSON list of all available sources, or 304 Not Modified if the client copy is current
         """
+        etag = sources_service.get_sources_etag()
+        headers = {"ETag": etag, "Cache-Control": SOURCES_CACHE_CONTROL}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            logger.info("Sources not modified, returning 304")
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
         logger.info("Getting all sources")
-        sources = sources_service.get_all_sources()
-        logger.info(f"Found {len(sources)} sources")
-        return sources
+        return Response(content=sources_service.get_sources_json(), media_type="application/json", headers=headers)
@@ -1,5 +1,5 @@
 import uuid
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -24,12 +24,19 @@ class SearchResultHistory(BaseModel):
     """Model representing a search history result (internal storage).
     
     Stores only IDs and confidence scores to save memory.
-    Full SearchResult objects are reconstructed when needed.
+    Full SearchResult objects are reconstructed when needed, except for the top three results shown
+    in the history list, which are kept as is.
     """
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     query: str
     time_searched: str
     all_search_results: List[Dict[str, float]]  # List of dicts with 'id' and 'confidence' keys
+    top_three_images: Optional[List[SearchResult]] = None  # None if not stored, reconstructed on read
+
+    @property
+    def sort_key(self) -> Tuple[str, str]:
+        """Key history is ordered by (and paginated on): time searched, then ID to break ties."""
+        return self.time_searched, self.id
 
 
 class SearchResultHistoryResponse(BaseModel):
@@ -40,7 +47,15 @@ class SearchResultHistoryResponse(BaseModel):
     top_three_images: List[SearchResult]
 
 
+class PaginationParams(BaseModel):
+    """API model representing pagination query parameters."""
+    startIndex: int = Field(0, description="Starting index for pagination (ignored when cursor is set)", ge=0)
+    limit: int = Field(10, description="Number of items per page", ge=1, le=100)
+    cursor: Optional[str] = Field(None, description="Opaque cursor from a previous page's next_cursor")
+
+
 class HistoryResponse(BaseModel):
     """API model representing paginated history response."""
     items: List[SearchResultHistoryResponse]
     total: int
+    next_cursor: Optional[str] = None  # Cursor for the next page, None on the last page
@@ -1,12 +1,52 @@
 """Service for managing search history."""
+import base64
+import binascii
 from datetime import datetime, timezone
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
-from app.domain.models import HistoryResponse, SearchResultHistory, SearchResult, SearchResultHistoryResponse, Source
+from app.domain.models import HistoryResponse, SearchResultHistory, SearchResult, SearchResultHistoryResponse
 from app.infra.db import SpaceDB
+from app.utils.constants import HISTORY_RESULTS_RETENTION
 from app.utils.logger import logger
 
 
+def encode_history_cursor(search_results_history: SearchResultHistory) -> str:
+    """
+    Encode the position of a history item into an opaque pagination cursor.
+
+    Args:
+        search_results_history: The last history item of a page.
+
+    Returns:
+        A URL-safe cursor string pointing right after the item.
+    """
+    time_searched, history_id = search_results_history.sort_key
+    return base64.urlsafe_b64encode(f"{time_searched}|{history_id}".encode("utf-8")).decode("ascii")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Decode a pagination cursor back into the (time_searched, id) sort key it points at.
+
+    Args:
+        cursor: A cursor produced by encode_history_cursor.
+
+    Returns:
+        The (time_searched, id) sort key.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        time_searched, separator, history_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode(
+            "utf-8").partition("|")
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+    if not separator:
+        raise ValueError(f"Invalid history cursor: {cursor}")
+    return time_searched, history_id
+
+
 class HistoryService:
     """Service for managing search history."""
 
@@ -23,7 +63,8 @@ class HistoryService:
         """
         Add a new search result history to the database.
         
-        Stores only IDs and confidence scores to save memory.
+        Stores only IDs and confidence scores of the top HISTORY_RESULTS_RETENTION results to save memory,
+        plus the top three results themselves so listing history needs no source lookups.
 
         Args:
             query (str): The query to search for.
@@ -32,51 +73,67 @@ class HistoryService:
         Returns:
             None
         """
-        logger.info(f"Adding new search result history for query: '{query}'")
-        current_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        # Store only IDs and confidence scores
-        results_data = [{"id": result.id, "confidence": result.confidence} for result in final_results]
+        logger.info("Adding new search result history for query: '%s'", query)
+        now = datetime.now(timezone.utc)
+        # Format as "%Y-%m-%dT%H:%M:%SZ" directly from the fields rather than going through strftime
+        current_time = (f"{now.year:04d}-{now.month:02d}-{now.day:02d}"
+                        f"T{now.hour:02d}:{now.minute:02d}:{now.second:02d}Z")
+        # Store only IDs and confidence scores of the top results, so history size doesn't grow with the limit
+        results_data = [{"id": result.id, "confidence": result.confidence}
+                        for result in final_results[:HISTORY_RESULTS_RETENTION]]
         new_search_result_history: SearchResultHistory = SearchResultHistory(
             query=query,
             time_searched=current_time,
-            all_search_results=results_data
+            all_search_results=results_data,
+            # Copied, so later changes to the caller's results don't leak into history
+            top_three_images=[result.model_copy() for result in final_results[:3]]
         )
         self.db.add_search_result_history(new_search_result_history)
-        logger.info(f"Added new search result history for query: '{query}' with {len(results_data)} results")
+        logger.info("Added new search result history for query: '%s' with %s results", query, len(results_data))
 
-    def get_history(self, start_index: int = 0, limit: int = 10) -> HistoryResponse:
+    def get_history(self, start_index: int = 0, limit: int = 10, cursor: Optional[str] = None) -> HistoryResponse:
         """Get paginated search history, sorted by most recent first.
 
+        Pages are addressed either by offset (start_index) or, when given, by a cursor taken from the
+        previous page's next_cursor. Cursor pages stay consistent while history is added or deleted.
+
         Args:
-            start_index: Starting index for pagination.
+            start_index: Starting index for pagination (ignored when cursor is set).
             limit: Maximum number of items to return.
+            cursor: Cursor returned as next_cursor by the previous page.
 
         Returns:
-            HistoryResponse containing paginated items and total count.
+            HistoryResponse containing paginated items, total count and the next page cursor.
+
+        Raises:
+            ValueError: If the cursor is malformed.
         """
-        logger.info(f"Getting history: start_index={start_index}, limit={limit}")
-        all_history = self.db.get_all_search_results_history()
-        all_history_responses = [self.create_search_results_history_response(search_results_history) for
-                                 search_results_history in all_history]
-        total = len(all_history)
-
-        # Sort by time_searched in descending order (most recent first)
-        sorted_history = sorted(
-            all_history_responses,
-            key=lambda x: x.time_searched,
-            reverse=True
-        )
+        logger.info("Getting history: start_index=%s, limit=%s, cursor=%s", start_index, limit, cursor)
+        total = self.db.count_search_results_history()
+
+        if cursor is not None:
+            # Fetch one extra item to know whether there is a next page
+            page = self.db.get_search_results_history_before(decode_history_cursor(cursor), limit + 1)
+            has_more = len(page) > limit
+            page = page[:limit]
+        else:
+            page = self.db.get_search_results_history_page(start_index, limit)
+            has_more = start_index + len(page) < total
 
-        # Apply pagination
-        items = sorted_history[start_index:start_index + limit]
+        # Only the requested page is converted into response models
+        items = [self.create_search_results_history_response(search_results_history) for
+                 search_results_history in page]
 
-        logger.info(f"Returning {len(items)} history items (total: {total})")
-        return HistoryResponse(items=items, total=total)
+        next_cursor = encode_history_cursor(page[-1]) if has_more and page else None
+
+        logger.info("Returning %s history items (total: %s)", len(items), total)
+        return HistoryResponse(items=items, total=total, next_cursor=next_cursor)
 
     def create_search_results_history_response(self, search_results_history: SearchResultHistory) -> SearchResultHistoryResponse:
         """Create a SearchResultHistoryResponse from a SearchResultHistory.
         
-        Reconstructs the top 3 SearchResult objects from stored IDs and confidence scores.
+        Uses the stored top 3 SearchResult objects, or reconstructs them from stored IDs and confidence scores
+        for history items stored without them.
         
         Args:
             search_results_history: The history item with stored IDs and confidence scores.
@@ -84,9 +141,10 @@ class HistoryService:
         Returns:
             SearchResultHistoryResponse with top 3 full SearchResult objects.
         """
-        logger.info(f"Creating SearchResultHistoryResponse for history item with ID: {search_results_history.id}")
-        top_three_data = search_results_history.all_search_results[:3]
-        top_three_results = self._reconstruct_search_results(top_three_data)
+        logger.info("Creating SearchResultHistoryResponse for history item with ID: %s", search_results_history.id)
+        top_three_results = search_results_history.top_three_images
+        if top_three_results is None:
+            top_three_results = self._reconstruct_search_results(search_results_history.all_search_results[:3])
         return SearchResultHistoryResponse(
             id=search_results_history.id,
             query=search_results_history.query,
@@ -103,7 +161,7 @@ class HistoryService:
         Returns:
             List of SearchResult objects.
         """
-        logger.debug(f"Reconstructing SearchResult objects from stored IDs and confidence scores: {results_data}")
+        logger.debug("Reconstructing SearchResult objects from stored IDs and confidence scores: %s", results_data)
         if not results_data:
             return []
 
@@ -112,33 +170,19 @@ class HistoryService:
 
         # Get sources from database
         sources_dict = self.db.get_sources_by_ids(source_ids)
-
-        # Reconstruct SearchResult objects
-        reconstructed_results = []
-        logger.debug(f"Reconstructing {len(results_data)} SearchResult objects")
-        for result_data in results_data:
-            source_id = int(result_data["id"])
-            confidence = result_data["confidence"]
-
-            if source_id not in sources_dict:
-                logger.warning(f"Source with ID {source_id} not in database, skipping")
-                continue
-
-            source_dict = sources_dict[source_id]
-            source = Source(**source_dict)
-            search_result = SearchResult(
-                id=source.id,
-                name=source.name,
-                type=source.type,
-                launch_date=source.launch_date,
-                description=source.description,
-                image_url=source.image_url,
-                status=source.status,
-                confidence=confidence
-            )
-            reconstructed_results.append(search_result)
-
-        logger.debug(f"Reconstructed {len(reconstructed_results)} SearchResult objects")
+        missing_ids = [source_id for source_id in source_ids if source_id not in sources_dict]
+        if missing_ids:
+            logger.warning("Sources with IDs %s not in database, skipping", missing_ids)
+
+        # Reconstruct SearchResult objects. Sources are already validated by the database, so the results are
+        # built without re-validating them
+        logger.debug("Reconstructing %d SearchResult objects", len(results_data))
+        reconstructed_results = [
+            SearchResult.model_construct(**dict(sources_dict[source_id]), confidence=result_data["confidence"])
+            for result_data, source_id in zip(results_data, source_ids) if source_id in sources_dict
+        ]
+
+        logger.debug("Reconstructed %d SearchResult objects", len(reconstructed_results))
         return reconstructed_results
 
     def get_history_results(self, history_id: str) -> List[SearchResult]:
@@ -155,17 +199,17 @@ class HistoryService:
         Raises:
             ValueError: If the history item is not found.
         """
-        logger.info(f"Getting history results for ID: {history_id}")
-        all_history = self.db.get_all_search_results_history()
-        for history_item in all_history:
-            if history_item.id == history_id:
-                logger.info(f"Found history item with {len(history_item.all_search_results)} results")
-                # Reconstruct full SearchResult objects from stored IDs and confidence scores
-                results = self._reconstruct_search_results(history_item.all_search_results)
-                logger.info(f"Reconstructed {len(results)} SearchResult objects")
-                return results
-        logger.warning(f"History item with ID {history_id} not found")
-        raise ValueError(f"History item with ID {history_id} not found")
+        logger.info("Getting history results for ID: %s", history_id)
+        try:
+            history_item = self.db.get_search_result_history_by_id(history_id)
+        except ValueError:
+            logger.warning("History item with ID %s not found", history_id)
+            raise
+        logger.info("Found history item with %s results", len(history_item.all_search_results))
+        # Reconstruct full SearchResult objects from stored IDs and confidence scores
+        results = self._reconstruct_search_results(history_item.all_search_results)
+        logger.info("Reconstructed %s SearchResult objects", len(results))
+        return results
 
     def delete_history_item(self, history_id: str) -> bool:
         """Delete a history item by ID.
@@ -176,10 +220,10 @@ class HistoryService:
         Returns:
             True if the item was found and deleted, False otherwise.
         """
-        logger.info(f"Deleting history item with ID: {history_id}")
+        logger.info("Deleting history item with ID: %s", history_id)
         deleted = self.db.delete_search_result_history(history_id)
         if deleted:
-            logger.info(f"Successfully deleted history item: {history_id}")
+            logger.info("Successfully deleted history item: %s", history_id)
         else:
-            logger.warning(f"History item not found: {history_id}")
+            logger.warning("History item not found: %s", history_id)
         return deleted
@@ -1,79 +1,91 @@
 """Search service for semantic image search using embeddings."""
-from typing import List, Dict, Any
+from typing import List, Optional, Tuple
 
+import numpy as np
 import torch
 
-from app.domain.models import SearchResult, Source
+from app.domain.models import SearchResult
 from app.domain.services.history_service import HistoryService
 from app.infra.db import SpaceDB
 from app.infra.language_model import LanguageModel
-from app.utils.constants import EMBEDDING_KEY, NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM, NORMALIZED_MEDIAN
-from app.utils.embedding_utils import calculate_image_and_text_similarity
+from app.utils.cache_utils import LRUCache
+from app.utils.constants import (
+    NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM, NORMALIZED_MEDIAN, SEARCH_RESULTS_CACHE_SIZE, TEXT_EMBEDDING_CACHE_SIZE
+)
+from app.utils.embedding_utils import normalize_embedding
 from app.utils.logger import logger
 
 
-def normalize_results(results: List[SearchResult]) -> List[SearchResult]:
-    f"""
-    Normalize the confidence scores for a list of SearchResult objects.
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query for cache lookups.
 
-    This function rescales each score to a value between {NORMALIZED_MINIMUM} and {NORMALIZED_MAXIMUM}. 
-    If all scores are identical, all results will be assigned a confidence of {NORMALIZED_MEDIAN}.
+    CLIP's tokenizer lower-cases text and collapses whitespace, so queries differing only in case or
+    spacing produce the same text embedding and can share cached results.
 
     Args:
-        results (List[SearchResult]): List of SearchResult objects with confidence attributes.
+        query (str): The raw search query.
 
     Returns:
-        List[SearchResult]: List of SearchResult objects with normalized confidence values.
+        str: The lower-cased query with runs of whitespace collapsed to single spaces.
+    """
+    return " ".join(query.split()).lower()
+
+
+def scale_confidences(confidences: np.ndarray, min_confidence: float, max_confidence: float) -> np.ndarray:
+    """
+    Rescale confidence scores from [min_confidence, max_confidence] to [NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM].
+
+    If the range is empty, every score is mapped to NORMALIZED_MEDIAN.
+
+    Args:
+        confidences (np.ndarray): 1-D array of confidence scores.
+        min_confidence (float): Lower bound of the input range.
+        max_confidence (float): Upper bound of the input range.
+
+    Returns:
+        np.ndarray: The rescaled float64 scores.
     """
-    logger.info(f"Normalizing search results between {NORMALIZED_MINIMUM} to {NORMALIZED_MAXIMUM}")
-    confidence_values = [result.confidence for result in results]
-    min_confidence = min(confidence_values)
-    max_confidence = max(confidence_values)
     confidence_range = max_confidence - min_confidence
-    logger.debug(
-        f"Confidence range: {confidence_range}, min_confidence: {min_confidence}, max_confidence: {max_confidence}")
-
-    scaled_results = []
-    for result in results:
-        if confidence_range == 0:  # If the confidence range is 0, we return a default confidence of {NORMALIZED_MEDIAN}
-            result.confidence = NORMALIZED_MEDIAN
-        else:  # If the confidence range is not 0, we scale the confidence
-            logger.debug(f"Scaling confidence for result: {result.name}")
-            norm_confidence = result.confidence
-            logger.debug(f"Normalized confidence: {norm_confidence}")
-            result.confidence = NORMALIZED_MINIMUM + (NORMALIZED_MAXIMUM - NORMALIZED_MINIMUM) * (
-                        (norm_confidence - min_confidence) / confidence_range)
-        scaled_results.append(result)
-    return scaled_results
-
-
-def calculate_similarity_for_one_source(source_dict: Dict[str, Any], text_vec: torch.Tensor) -> SearchResult:
+    logger.debug("Confidence range: %s, min_confidence: %s, max_confidence: %s",
+                 confidence_range, min_confidence, max_confidence)
+    if confidence_range == 0:
+        return np.full(len(confidences), NORMALIZED_MEDIAN)
+    return NORMALIZED_MINIMUM + (NORMALIZED_MAXIMUM - NORMALIZED_MINIMUM) * (
+            (np.asarray(confidences, dtype=np.float64) - min_confidence) / confidence_range)
+
+
+def normalize_results(
+    results: List[SearchResult],
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None
+) -> List[SearchResult]:
     """
-    Calculate similarity between an image and a text vector.
+    Normalize the confidence scores for a list of SearchResult objects.
+
+    This function rescales each score to a value between NORMALIZED_MINIMUM and NORMALIZED_MAXIMUM.
+    If all scores are identical, all results will be assigned a confidence of NORMALIZED_MEDIAN.
 
     Args:
-        source_dict: The source dictionary.
-        text_vec: The text vector.
+        results (List[SearchResult]): List of SearchResult objects with confidence attributes.
+        min_confidence (Optional[float]): Lower bound of the scale. Defaults to the lowest confidence in results.
+        max_confidence (Optional[float]): Upper bound of the scale. Defaults to the highest confidence in results.
 
     Returns:
-        SearchResult: The search result.
+        List[SearchResult]: List of SearchResult objects with normalized confidence values.
     """
-    # Calculate Similarity between an image and a text vector
-    image_vec = torch.tensor(source_dict[EMBEDDING_KEY])
-    score = calculate_image_and_text_similarity(image_vec, text_vec)
-    logger.debug(f"Similarity score: {score}")
-    source_clean = {k: v for k, v in source_dict.items() if k != EMBEDDING_KEY}
-    source_dict = Source(**source_clean)
-    return SearchResult(
-        id=source_dict.id,
-        name=source_dict.name,
-        type=source_dict.type,
-        launch_date=source_dict.launch_date,
-        description=source_dict.description,
-        image_url=source_dict.image_url,
-        status=source_dict.status,
-        confidence=round(score * 100, 2),
-    )
+    logger.info("Normalizing search results between %s to %s", NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM)
+    if not results:
+        return results
+    confidences = np.fromiter((result.confidence for result in results), dtype=np.float64, count=len(results))
+    if min_confidence is None:
+        min_confidence = float(confidences.min())
+    if max_confidence is None:
+        max_confidence = float(confidences.max())
+
+    for result, confidence in zip(results, scale_confidences(confidences, min_confidence, max_confidence).tolist()):
+        result.confidence = confidence
+    return results
 
 
 class SearchService:
@@ -85,10 +97,18 @@ class SearchService:
         self.db = db
         self.lm = lm
         self.history_service = history_service
+        # Sources are static once loaded, so results only depend on the normalized query and the limit
+        self._results_cache: LRUCache[Tuple[str, int], Tuple[SearchResult, ...]] = LRUCache(
+            SEARCH_RESULTS_CACHE_SIZE)
+        # Normalized text embeddings per normalized query, shared across limits
+        self._text_embedding_cache: LRUCache[str, np.ndarray] = LRUCache(TEXT_EMBEDDING_CACHE_SIZE)
 
     def search(self, query: str, limit: int = 15, save_to_history: bool = True) -> List[SearchResult]:
         """Perform semantic search using vector embeddings.
 
+        Results are cached per normalized query and limit; repeated searches skip encoding and scoring
+        but are still saved to history.
+
         Args:
             query (str): The query to search for.
             limit (int): The maximum number of results to return.
@@ -97,39 +117,83 @@ class SearchService:
         Returns:
             List[SearchResult]: List of SearchResult objects with normalized confidence values.
         """
-        logger.info(f"Searching for: '{query}' with limit of {limit} results")
+        logger.info("Searching for: '%s' with limit of %s results", query, limit)
 
         # Check if the query is valid
         if not query or not query.strip():
             return []
 
-        # Encode the search text
-        inputs = self.lm.processor(text=[query], return_tensors="pt", padding=True)
-        with torch.no_grad():
-            text_features: torch.Tensor = self.lm.model.get_text_features(**inputs)
+        cache_key = (normalize_query(query), limit)
+        cached_results = self._results_cache.get(cache_key)
+        if cached_results is None:
+            cached_results = tuple(self._rank_sources(query, limit))
+            self._results_cache.put(cache_key, cached_results)
+        else:
+            logger.info("Using cached results for: '%s'", query)
+
+        # Callers and history get their own copies, so changing a returned result can't corrupt the cache
+        returned_results = [result.model_copy() for result in cached_results]
+        # Only save to history if requested
+        if save_to_history:
+            self.history_service.add_search_result_history(query, returned_results)
 
-        results = []
-        # Convert text features to a Torch tensor for comparison
-        text_vec = text_features.clone().detach()
+        return returned_results
 
-        all_sources: List[Dict] = self.db.get_all_sources_with_embedding()
+    def _encode_text(self, query: str) -> np.ndarray:
+        """Encode a query into an L2-normalized text embedding, reusing cached embeddings.
 
-        logger.debug(f"Found {len(all_sources)} sources")
-        for source_dict in all_sources:
-            if EMBEDDING_KEY not in source_dict or source_dict[EMBEDDING_KEY] is None:
-                continue
-            search_result = calculate_similarity_for_one_source(source_dict, text_vec)
-            results.append(search_result)
+        Args:
+            query (str): The query to encode.
 
-        normalized_results = normalize_results(results)
+        Returns:
+            np.ndarray: Read-only float32 vector of shape (D,).
+        """
+        query_norm = normalize_query(query)
+        text_vec = self._text_embedding_cache.get(query_norm)
+        if text_vec is not None:
+            logger.debug("Using cached text embedding for: '%s' (hit ratio %.2f)", query_norm,
+                         self._text_embedding_cache.hit_ratio)
+            return text_vec
 
-        # Sort by similarity descending
-        normalized_results.sort(key=lambda x: x.confidence, reverse=True)
-        logger.info(f"Found {len(normalized_results)} results")
+        # Encode the search text
+        inputs = self.lm.processor(text=[query_norm], return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            text_features: torch.Tensor = self.lm.model.get_text_features(**inputs)
 
-        returned_results = normalized_results[:limit]
-        # Only save to history if requested
-        if save_to_history:
-            self.history_service.add_search_result_history(query, returned_results)
+        # The text encoder may run in reduced precision; scoring is always done in float32
+        text_vec = normalize_embedding(text_features.float().cpu().numpy())
+        # The vector is shared by every later search for the same query, so guard it against in-place edits
+        text_vec.flags.writeable = False
+        self._text_embedding_cache.put(query_norm, text_vec)
+        return text_vec
 
-        return returned_results
+    def _rank_sources(self, query: str, limit: int) -> List[SearchResult]:
+        """Encode the query and rank all sources against it.
+
+        Args:
+            query (str): The query to search for.
+            limit (int): The maximum number of results to return.
+
+        Returns:
+            List[SearchResult]: The top `limit` results, sorted by normalized confidence.
+        """
+        text_vec = self._encode_text(query)
+        top_scores, top_indices, min_score = self.db.search_by_embedding(text_vec, limit)
+        logger.debug("Found %d top sources", len(top_indices))
+        if len(top_indices) == 0:
+            return []
+
+        confidences = np.round(top_scores.astype(np.float64) * 100, 2)
+        # Only the top `limit` sources become SearchResults, but they are scaled against the full score range,
+        # from the lowest score of all sources up to the best one
+        normalized_confidences = scale_confidences(
+            confidences, np.round(np.float64(min_score) * 100, 2), confidences[0])
+        sources = self.db.get_embedded_sources()
+        # Sources were validated when the database loaded them, so results are built without re-validating
+        normalized_results = [
+            SearchResult.model_construct(**sources[i], confidence=confidence)
+            for i, confidence in zip(top_indices.tolist(), normalized_confidences.tolist())
+        ]
+        logger.info("Found %s results", len(normalized_results))
+
+        return normalized_results
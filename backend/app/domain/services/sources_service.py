@@ -1,4 +1,7 @@
-from typing import List
+import hashlib
+from typing import List, Optional
+
+import orjson
 
 from app.domain.models import Source
 from app.infra.db import SpaceDB
@@ -12,11 +15,39 @@ class SourcesService:
         """Initialize the SourcesService."""
         logger.info("Initializing SourcesService")
         self.db = db
+        self._sources_json: Optional[bytes] = None
+        self._sources_etag: Optional[str] = None
 
     def get_all_sources(self) -> List[Source]:
         """Get all sources from the database."""
         logger.info("Getting all sources")
-        sources_dict = self.db.get_all_sources()
-        sources = [Source(**source) for source in sources_dict]
-        logger.info(f"Found {len(sources)} sources")
+        # The database validates the sources once on load and hands out the same models on every call
+        sources = self.db.get_all_source_models()
+        logger.info("Found %s sources", len(sources))
         return sources
+
+    def get_sources_json(self) -> bytes:
+        """Get the sources list encoded as a JSON response body.
+
+        Sources do not change once the database is loaded, so the list is encoded on first use and reused.
+
+        Returns:
+            The JSON-encoded list of sources.
+        """
+        if self._sources_json is None:
+            logger.info("Encoding sources JSON")
+            self._sources_json = orjson.dumps([source.model_dump(mode="json") for source in self.get_all_sources()])
+        return self._sources_json
+
+    def get_sources_etag(self) -> str:
+        """Get the ETag of the sources list.
+
+        Sources do not change once the database is loaded, so the hash is computed on first use and reused.
+
+        Returns:
+            A quoted strong ETag derived from the encoded sources list.
+        """
+        if self._sources_etag is None:
+            logger.info("Computing sources ETag")
+            self._sources_etag = f'"{hashlib.sha256(self.get_sources_json()).hexdigest()}"'
+        return self._sources_etag
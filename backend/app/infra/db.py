@@ -1,18 +1,29 @@
 """In-memory database for NASA space images with vector embeddings."""
 
-import json
 import os
-from typing import Dict, List, Optional, Any
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Any, Tuple, Union
 
 import numpy as np
+import orjson
 from tqdm import tqdm
 
-from app.domain.models import SearchResultHistory
+try:
+    import faiss
+except ImportError:  # faiss is optional and only needed for VECTOR_INDEX=faiss or hnsw
+    faiss = None
+
+from app.domain.models import SearchResultHistory, Source
 from app.infra.language_model import LanguageModel
-from app.utils.constants import MOCK_DATA_JSON, EMBEDDING_KEY
+from app.utils.constants import (
+    EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_SAVE_INTERVAL, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, HNSW_MIN_SOURCES,
+    HNSW_NEIGHBORS, MOCK_DATA_JSON, QUANTIZED_SCORING_BLOCK_ROWS, VECTOR_INDEXES
+)
 from app.utils.embedding_utils import (
     save_embeddings_cache,
-    check_for_cached_embeddings, get_image_embedding
+    check_for_cached_embeddings, get_embedding_cache_key, get_embeddings_from_image_urls, normalize_embedding,
+    quantize_int8, top_k_indices
 )
 from app.utils.logger import logger
 
@@ -20,115 +31,306 @@ from app.utils.logger import logger
 class SpaceDB:
     """In-memory database for NASA space images with vector embeddings."""
 
-    def __init__(self, lm: LanguageModel):
-        """Initialize the SpaceDB."""
+    def __init__(self, lm: LanguageModel, quantize: Optional[bool] = None, vector_index: Optional[str] = None):
+        """Initialize the SpaceDB.
+
+        Args:
+            lm: The language model used to generate missing image embeddings.
+            quantize: Whether to keep the embeddings as int8 with per-row scales instead of float32, trading a
+                little scoring precision for 4x less memory. Defaults to EMBEDDING_QUANTIZATION=int8.
+            vector_index: How search_by_embedding finds the best sources, one of VECTOR_INDEXES: "numpy" scores
+                every source with one matrix-vector product, "faiss" searches an exact faiss inner product
+                index, and "hnsw" searches an approximate faiss HNSW graph once there are at least
+                HNSW_MIN_SOURCES embedded sources (an exact index below that). Defaults to the VECTOR_INDEX
+                environment variable, or "numpy".
+
+        Raises:
+            ValueError: If EMBEDDING_QUANTIZATION is neither "none" nor "int8", if the vector index is unknown,
+                or if a faiss index is requested without faiss installed or together with quantization.
+        """
         logger.info("Initializing SpaceDB")
         self._lm: LanguageModel = lm
+        if quantize is None:
+            quantization = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+            if quantization not in ("none", "int8"):
+                raise ValueError(f"Unsupported EMBEDDING_QUANTIZATION '{quantization}', expected 'none' or 'int8'")
+            quantize = quantization == "int8"
+        self._quantize: bool = quantize
+        if vector_index is None:
+            vector_index = os.getenv("VECTOR_INDEX", "numpy").lower()
+        if vector_index not in VECTOR_INDEXES:
+            raise ValueError(f"Unsupported VECTOR_INDEX '{vector_index}', expected one of {list(VECTOR_INDEXES)}")
+        if vector_index != "numpy":
+            if faiss is None:
+                raise ValueError(f"VECTOR_INDEX '{vector_index}' requires faiss, install faiss-cpu")
+            if quantize:
+                raise ValueError(f"VECTOR_INDEX '{vector_index}' cannot be combined with int8 quantization")
+        self._vector_index: str = vector_index
+        # History is kept ordered by SearchResultHistory.sort_key, with the keys in a parallel list for bisecting
         self._search_results_history: List[SearchResultHistory] = []
+        self._search_results_history_keys: List[Tuple[str, str]] = []
+        self._search_results_history_by_id: Dict[str, SearchResultHistory] = {}
+        # Searches add history from threadpool workers, so the parallel lists are only read or changed under this lock
+        self._history_lock = threading.Lock()
 
         # Load data
         data_path = os.path.join(os.path.dirname(__file__), MOCK_DATA_JSON)
-        with open(data_path, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
+        # orjson parses the data file straight from bytes, several times faster than the json module
+        with open(data_path, "rb") as f:
+            json_data = orjson.loads(f.read())
 
-        # Parse sources
-        self._sources = []
+        # Parse sources. Source dicts only hold metadata; the embeddings live in one matrix (see score_all)
         items = json_data.get("collection", {}).get("items", [])
+        logger.info(f"Processing {len(items)} sources")
+        self._sources: List[Dict] = [self.process_one_source(idx, item) for idx, item in enumerate(items, start=1)]
 
-        cache_path, cached_embeddings = check_for_cached_embeddings(data_path)
+        cache_path, cached_embeddings = check_for_cached_embeddings()
+        cached_embeddings = self._rekey_index_keyed_embeddings(cached_embeddings, items) or {}
+        embeddings = self._embed_sources(cached_embeddings, cache_path)
 
-        # Prepare embeddings dict for saving
-        embeddings_to_cache = {}
+        # Save embeddings to cache if they differ from the cached ones, or were loaded from a legacy cache
+        if embeddings.keys() != cached_embeddings.keys() or not os.path.exists(cache_path):
+            save_embeddings_cache(embeddings, cache_path)
 
-        logger.info(f"Processing {len(items)} sources")
-        for idx, item in enumerate(tqdm(items, desc="Processing sources"), start=1):
-            source = self.process_one_source(cached_embeddings, embeddings_to_cache, idx, item)
-            self._sources.append(source)
-
-        # Save embeddings to cache if we generated any new ones
-        if not cached_embeddings or len(embeddings_to_cache) != len(cached_embeddings):
-            save_embeddings_cache(embeddings_to_cache, cache_path)
+        # Sources never change once loaded, so their validated models are built once
+        self._source_models: List[Source] = [Source(**source) for source in self._sources]
+        self._sources_by_id: Dict[int, Source] = {source.id: source for source in self._source_models}
+        self._build_embedding_matrix(embeddings)
+        self._build_vector_index()
+        # Search results are cached, so the embeddings they were scored against must never change
+        for array in (self._emb_matrix, self._emb_q, self._emb_scales):
+            if array is not None:
+                array.flags.writeable = False
 
         logger.info(
             f"SpaceDB initialized: {len(self._sources)} sources, "
-            f"{sum(1 for s in self._sources if 'embedding' in s)} with embeddings"
+            f"{len(self._embedded_sources)} with embeddings"
         )
 
-    def process_one_source(
-        self, 
-        cached_embeddings: Optional[Dict[int, np.ndarray]], 
-        embeddings_to_cache: Dict[int, np.ndarray], 
-        idx: int, 
-        item: Dict[str, Any]
-    ) -> Dict[str, Any]:
+    def _embed_sources(self, cached_embeddings: Dict[str, np.ndarray], cache_path: str) -> Dict[str, np.ndarray]:
+        """Get the embedding of every source image, generating the ones missing from the cache in batches.
+
+        Missing images are embedded EMBEDDING_BATCH_SIZE at a time, and the cache is saved every
+        EMBEDDING_CACHE_SAVE_INTERVAL generated embeddings, so an interrupted startup only regenerates what is left.
+
+        Args:
+            cached_embeddings: The cached embeddings, keyed by get_embedding_cache_key.
+            cache_path: Path to the cache file.
+
+        Returns:
+            The L2-normalized embeddings of the source images, keyed by get_embedding_cache_key.
+        """
+        embeddings: Dict[str, np.ndarray] = {}
+        # Image URLs missing from the cache by cache key, so images shared by several sources are embedded once
+        missing_image_urls: Dict[str, Optional[str]] = {}
+        for source in self._sources:
+            cache_key = get_embedding_cache_key(source["image_url"])
+            if cache_key in cached_embeddings:
+                embeddings[cache_key] = cached_embeddings[cache_key]
+            else:
+                missing_image_urls[cache_key] = source["image_url"]
+        logger.info(f"Using {len(embeddings)} cached embeddings, generating {len(missing_image_urls)}")
+
+        missing = list(missing_image_urls.items())
+        unsaved_embeddings = 0
+        for start in tqdm(range(0, len(missing), EMBEDDING_BATCH_SIZE), desc="Embedding images"):
+            batch = missing[start:start + EMBEDDING_BATCH_SIZE]
+            batch_embeddings = get_embeddings_from_image_urls(
+                self._lm.model, self._lm.processor, [image_url for _, image_url in batch])
+            for (cache_key, _), embedding in zip(batch, batch_embeddings):
+                # Normalize once here, so cached embeddings are ready for scoring as they are loaded
+                embeddings[cache_key] = normalize_embedding(embedding)
+            unsaved_embeddings += len(batch)
+            if unsaved_embeddings >= EMBEDDING_CACHE_SAVE_INTERVAL:
+                save_embeddings_cache({**cached_embeddings, **embeddings}, cache_path)
+                unsaved_embeddings = 0
+        return embeddings
+
+    def _build_embedding_matrix(self, embeddings: Dict[str, Optional[np.ndarray]]) -> None:
+        """Copy the source embeddings into one contiguous (N, D) float32 matrix for scoring.
+
+        Args:
+            embeddings: The embeddings by cache key, already L2-normalized by _embed_sources.
         """
-        Process one source and return a dictionary with the source data with the embedding.
+        source_embeddings = [
+            (source, embeddings.get(get_embedding_cache_key(source["image_url"]))) for source in self._sources
+        ]
+        source_embeddings = [(source, embedding) for source, embedding in source_embeddings if embedding is not None]
+        # Row i of the matrix belongs to self._embedded_sources[i]
+        self._embedded_sources: List[Dict] = [source for source, _ in source_embeddings]
+        if source_embeddings:
+            dim = np.asarray(source_embeddings[0][1]).size
+            emb_matrix = np.empty((len(source_embeddings), dim), dtype=np.float32)
+            for row, (_, embedding) in enumerate(source_embeddings):
+                emb_matrix[row] = np.asarray(embedding).ravel()
+        else:
+            emb_matrix = np.empty((0, 0), dtype=np.float32)
+        self._emb_matrix: Optional[np.ndarray] = emb_matrix
+        # Quantized rows and their scales replace the float32 matrix when quantization is on
+        self._emb_q: Optional[np.ndarray] = None
+        self._emb_scales: Optional[np.ndarray] = None
+        if self._quantize:
+            self._emb_q, self._emb_scales = quantize_int8(emb_matrix)
+            self._emb_matrix = None
+            logger.info(f"Quantized embedding matrix of shape {self._emb_q.shape} to int8")
+        else:
+            logger.info(f"Built embedding matrix of shape {emb_matrix.shape}")
+
+    def _build_vector_index(self) -> None:
+        """Build the faiss index over the embedding matrix, when VECTOR_INDEX asks for one."""
+        self._index = None
+        if self._vector_index == "numpy" or not self._embedded_sources:
+            return
+        # The embeddings are L2-normalized, so inner products are cosine similarities
+        dim = self._emb_matrix.shape[1]
+        if self._vector_index == "hnsw" and len(self._embedded_sources) >= HNSW_MIN_SOURCES:
+            self._index = faiss.IndexHNSWFlat(dim, HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            self._index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            # The search beam must be at least as wide as the largest search limit to return that many results
+            self._index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            # Exact search is as fast as a graph walk on small catalogs, and needs no build time
+            self._index = faiss.IndexFlatIP(dim)
+        self._index.add(self._emb_matrix)
+        logger.info(f"Built faiss {type(self._index).__name__} over {self._index.ntotal} embeddings")
+
+    @staticmethod
+    def _get_image_url(item: Dict[str, Any]) -> Optional[str]:
+        """Get the image URL of a raw data item, or None if it has no image link."""
+        return next((link.get("href") for link in item.get("links", []) if link.get("render") == "image"), None)
+
+    @staticmethod
+    def _rekey_index_keyed_embeddings(
+        cached_embeddings: Optional[Dict[Union[str, int], np.ndarray]],
+        items: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """Re-key embeddings of pickled legacy caches, which are keyed by source index, by image URL.
+
+        Args:
+            cached_embeddings: The loaded cached embeddings.
+            items: The raw data items, in source index order.
+
+        Returns:
+            The cached embeddings keyed by get_embedding_cache_key.
+        """
+        if not cached_embeddings:
+            return cached_embeddings
+        rekeyed_embeddings = {}
+        for key, embedding in cached_embeddings.items():
+            if not isinstance(key, int):
+                rekeyed_embeddings[key] = embedding
+            elif 1 <= key <= len(items):
+                rekeyed_embeddings[get_embedding_cache_key(SpaceDB._get_image_url(items[key - 1]))] = embedding
+        return rekeyed_embeddings
+
+    def process_one_source(self, idx: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Process one source and return a dictionary with the source data.
 
         Args:
-            cached_embeddings: The cached embeddings.
-            embeddings_to_cache: The embeddings to cache.
             idx: The index of the source.
             item: The source item.
 
         Returns:
-            dict: The source data with the embedding.
+            dict: The source data without the embedding.
         """
-        logger.debug(f"Processing source {idx}")
-        data = item.get("data", [{}])[0]
-        links = item.get("links", [])
-        # Find image URL
-        image_url = None
-        for link in links:
-            if link.get("render") == "image":
-                image_url = link.get("href")
-                break
-        name = data.get("title", f"NASA Item {idx}")
-        description = data.get("description", "")
-        embedding = get_image_embedding(self._lm.model, self._lm.processor, cached_embeddings, idx, image_url)
-        embeddings_to_cache[idx] = embedding
-        source = {
+        logger.debug("Processing source %d", idx)
+        data = (item.get("data") or [{}])[0] or {}
+        return {
             "id": idx,
-            "name": name,
+            "name": data.get("title", f"NASA Item {idx}"),
             "type": data.get("media_type", "unknown"),
             "launch_date": data.get("date_created", ""),
-            "description": description,
-            "image_url": image_url,
+            "description": data.get("description", ""),
+            "image_url": self._get_image_url(item),
             "status": "Active",
-            EMBEDDING_KEY: embedding
         }
-        return source
 
     def get_all_sources(self) -> List[Dict]:
-        """Get all sources without embeddings."""
+        """Get all sources without embeddings.
+
+        The source dicts are shared between calls and must not be modified.
+        """
         logger.info("Getting all sources without embeddings")
-        return [
-            {k: v for k, v in source.items() if k != EMBEDDING_KEY}
-            for source in self._sources
-        ]
+        return list(self._sources)
+
+    def get_all_source_models(self) -> List[Source]:
+        """Get all sources as validated Source models, shared between calls."""
+        logger.info("Getting all source models")
+        return list(self._source_models)
 
-    def get_all_sources_with_embedding(self) -> List[Dict]:
-        """Get all sources with embeddings."""
-        logger.info("Getting all sources with embeddings")
-        return self._sources
+    def get_embedded_sources(self) -> List[Dict]:
+        """Get the sources that have an embedding (without embeddings), in score_all order."""
+        return self._embedded_sources
 
-    def get_sources_by_ids(self, source_ids: List[int]) -> Dict[int, Dict]:
-        """Get sources by their IDs (without embeddings).
+    def score_all(self, text_vec: np.ndarray) -> np.ndarray:
+        """Score every embedded source against a text vector in a single matrix-vector product.
+
+        Args:
+            text_vec: The L2-normalized text embedding, a float32 vector of shape (D,).
+
+        Returns:
+            The cosine similarity of each source in get_embedded_sources() order, shape (N,).
+        """
+        if not self._embedded_sources:
+            return np.empty(0, dtype=np.float32)
+        if self._emb_q is not None:
+            # Dequantize a block of rows at a time, so scoring goes through a float32 BLAS product without
+            # ever materializing the whole matrix in float32 (or int32), then rescale by the row scales
+            text_vec = np.asarray(text_vec, dtype=np.float32)
+            scores = np.empty(len(self._emb_q), dtype=np.float32)
+            for start in range(0, len(self._emb_q), QUANTIZED_SCORING_BLOCK_ROWS):
+                block = self._emb_q[start:start + QUANTIZED_SCORING_BLOCK_ROWS]
+                np.matmul(block.astype(np.float32), text_vec, out=scores[start:start + len(block)])
+            scores *= self._emb_scales
+        else:
+            scores = self._emb_matrix @ text_vec
+        # Rounding (and int8 quantization error) can push scores of near-identical vectors just past +-1
+        return np.clip(scores, -1.0, 1.0, out=scores)
+
+    def search_by_embedding(self, text_vec: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray, float]:
+        """Find the embedded sources most similar to a text vector.
+
+        Args:
+            text_vec: The L2-normalized text embedding, a float32 vector of shape (D,).
+            limit: The maximum number of sources to return.
+
+        Returns:
+            Tuple of (the top cosine similarities in descending order, their positions in get_embedded_sources(),
+            the lowest cosine similarity of all embedded sources). The lowest similarity is 0 without sources.
+        """
+        if not self._embedded_sources:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.intp), 0.0
+        if self._index is None:
+            scores = self.score_all(text_vec)
+            top_indices = top_k_indices(scores, limit)
+            return scores[top_indices], top_indices, float(scores.min())
+
+        query = np.ascontiguousarray(text_vec, dtype=np.float32).reshape(1, -1)
+        top_scores, top_indices = self._index.search(query, min(limit, self._index.ntotal))
+        # Approximate indexes pad with -1 when they find fewer neighbors than asked for
+        found = top_indices[0] >= 0
+        # The lowest similarity to the query is the negated highest similarity to the negated query
+        negated_scores, _ = self._index.search(-query, 1)
+        # Clipped like score_all, so both backends hand the same range to confidence scaling
+        return (np.clip(top_scores[0][found], -1.0, 1.0), top_indices[0][found].astype(np.intp),
+                float(np.clip(-negated_scores[0, 0], -1.0, 1.0)))
+
+    def get_sources_by_ids(self, source_ids: List[int]) -> Dict[int, Source]:
+        """Get sources by their IDs.
         
         Args:
             source_ids: List of source IDs to retrieve.
             
         Returns:
-            Dictionary mapping source ID to source dict (without embeddings).
+            Dictionary mapping source ID to its Source model. Unknown IDs are left out.
         """
-        logger.info(f"Getting sources by IDs")
-        sources_dict = {}
-        for source in self._sources:
-            source_id = source.get("id")
-            if source_id in source_ids:
-                # Return source without embedding
-                source_clean = {k: v for k, v in source.items() if k != EMBEDDING_KEY}
-                sources_dict[source_id] = source_clean
-        logger.info(f"Found {len(sources_dict)} sources out of {len(source_ids)} requested")
+        logger.info("Getting sources by IDs")
+        sources_dict = {
+            source_id: self._sources_by_id[source_id]
+            for source_id in source_ids if source_id in self._sources_by_id
+        }
+        logger.info("Found %s sources out of %s requested", len(sources_dict), len(source_ids))
         return sources_dict
 
     def get_all_search_results_history(self) -> List[SearchResultHistory]:
@@ -136,10 +338,78 @@ class SpaceDB:
         logger.info("Getting all search history results")
         return self._search_results_history
 
+    def get_search_result_history_by_id(self, history_id: str) -> SearchResultHistory:
+        """Get a search result history by ID.
+
+        Args:
+            history_id: The ID of the history item to retrieve.
+
+        Returns:
+            The SearchResultHistory object if found.
+
+        Raises:
+            ValueError: If the history item is not found.
+        """
+        logger.info("Getting search result history with ID: %s", history_id)
+        search_result_history = self._search_results_history_by_id.get(history_id)
+        if search_result_history is None:
+            raise ValueError(f"History item with ID {history_id} not found")
+        return search_result_history
+
+    def count_search_results_history(self) -> int:
+        """Get the number of search history results."""
+        return len(self._search_results_history)
+
+    def get_search_results_history_page(self, start_index: int, limit: int) -> List[SearchResultHistory]:
+        """Get a page of search history results, most recent first.
+
+        Args:
+            start_index: Number of most recent items to skip.
+            limit: Maximum number of items to return.
+
+        Returns:
+            Up to `limit` history items ordered from most to least recent.
+        """
+        logger.info("Getting search result history page: start_index=%s, limit=%s", start_index, limit)
+        with self._history_lock:
+            # History is ordered oldest first, so the page is the window counted from the end, reversed
+            end_index = max(len(self._search_results_history) - start_index, 0)
+            return self._search_results_history[max(end_index - limit, 0):end_index][::-1]
+
+    def get_search_results_history_before(
+        self,
+        key: Optional[Tuple[str, str]],
+        limit: int
+    ) -> List[SearchResultHistory]:
+        """Get the history items that come right before a sort key, most recent first.
+
+        Args:
+            key: The (time_searched, id) sort key to page from, exclusive. None starts from the most recent item.
+            limit: Maximum number of items to return.
+
+        Returns:
+            Up to `limit` history items ordered from most to least recent.
+        """
+        logger.info("Getting %s search result history items before %s", limit, key)
+        with self._history_lock:
+            end_index = len(self._search_results_history) if key is None else bisect_left(
+                self._search_results_history_keys, key)
+            return self._search_results_history[max(end_index - limit, 0):end_index][::-1]
+
     def add_search_result_history(self, search_result_history: SearchResultHistory) -> None:
-        """Append a new search result history."""
-        logger.info("Appending a new search result history")
-        self._search_results_history.append(search_result_history)
+        """Add a new search result history, keeping the history ordered by time searched."""
+        logger.info("Adding a new search result history")
+        key = search_result_history.sort_key
+        with self._history_lock:
+            if not self._search_results_history_keys or key >= self._search_results_history_keys[-1]:
+                # New searches are almost always the most recent, so they go straight to the end
+                self._search_results_history_keys.append(key)
+                self._search_results_history.append(search_result_history)
+            else:
+                index = bisect_left(self._search_results_history_keys, key)
+                self._search_results_history_keys.insert(index, key)
+                self._search_results_history.insert(index, search_result_history)
+            self._search_results_history_by_id[search_result_history.id] = search_result_history
 
     def delete_search_result_history(self, history_id: str) -> bool:
         """Delete a search result history by ID.
@@ -150,14 +420,22 @@ class SpaceDB:
         Returns:
             True if the item was found and deleted, False otherwise.
         """
-        logger.info(f"Deleting search result history with ID: {history_id}")
-        initial_length = len(self._search_results_history)
-        self._search_results_history = [
-            item for item in self._search_results_history if item.id != history_id
-        ]
-        deleted = len(self._search_results_history) < initial_length
+        logger.info("Deleting search result history with ID: %s", history_id)
+        with self._history_lock:
+            search_result_history = self._search_results_history_by_id.pop(history_id, None)
+            deleted = search_result_history is not None
+            if deleted:
+                # Sort keys are unique (they end with the ID), so bisecting finds the exact position to remove
+                index = bisect_left(self._search_results_history_keys, search_result_history.sort_key)
+                if (index >= len(self._search_results_history)
+                        or self._search_results_history[index].id != history_id):
+                    # Never remove another item: fall back to looking the item up by ID
+                    logger.warning("History item with ID %s not at its sort position, searching for it", history_id)
+                    index = next(i for i, item in enumerate(self._search_results_history) if item.id == history_id)
+                del self._search_results_history_keys[index]
+                del self._search_results_history[index]
         if deleted:
-            logger.info(f"Successfully deleted history item with ID: {history_id}")
+            logger.info("Successfully deleted history item with ID: %s", history_id)
         else:
-            logger.warning(f"History item with ID {history_id} not found")
+            logger.warning("History item with ID %s not found", history_id)
         return deleted
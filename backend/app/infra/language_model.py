@@ -1,8 +1,17 @@
+import os
 
+import torch
 from transformers import CLIPProcessor, CLIPModel
 
 from app.utils.logger import logger
 
+# Precisions the text encoder can run in, selected with the TEXT_MODEL_DTYPE environment variable
+TEXT_MODEL_DTYPES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
 
 class LanguageModel:
     """Language model for generating embeddings."""
@@ -10,10 +19,34 @@ class LanguageModel:
     MODEL_NAME = "openai/clip-vit-base-patch32"
 
     def __init__(self) -> None:
-        """Initialize the LanguageModel."""
+        """Initialize the LanguageModel.
+
+        Raises:
+            ValueError: If TEXT_MODEL_DTYPE is not one of TEXT_MODEL_DTYPES.
+        """
         logger.info("Initializing a language model with sentence-transformers")
+        text_dtype_name = os.getenv("TEXT_MODEL_DTYPE", "float32").lower()
+        if text_dtype_name not in TEXT_MODEL_DTYPES:
+            raise ValueError(
+                f"Unsupported TEXT_MODEL_DTYPE '{text_dtype_name}', expected one of {list(TEXT_MODEL_DTYPES)}")
         # Load the model and processor
         self.model = CLIPModel.from_pretrained(LanguageModel.MODEL_NAME)
         logger.debug(f"Model loaded: {LanguageModel.MODEL_NAME}")
         self.processor = CLIPProcessor.from_pretrained(LanguageModel.MODEL_NAME)
         logger.debug(f"Processor loaded: {LanguageModel.MODEL_NAME}")
+
+        # Only the text tower runs per search; the vision tower stays in float32 so cached image embeddings
+        # keep matching newly generated ones
+        self.text_dtype: torch.dtype = TEXT_MODEL_DTYPES[text_dtype_name]
+        if self.text_dtype != torch.float32:
+            self.model.text_model.to(self.text_dtype)
+            self.model.text_projection.to(self.text_dtype)
+            logger.info(f"Text encoder running in {text_dtype_name}")
+
+    def warmup(self) -> None:
+        """Run one text forward pass, so the first search doesn't pay for lazy kernel and tokenizer setup."""
+        logger.info("Warming up the text encoder")
+        inputs = self.processor(text=["warmup"], return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            self.model.get_text_features(**inputs)
+        logger.info("Text encoder warmed up")
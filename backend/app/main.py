@@ -3,6 +3,7 @@
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.api.dependencies import get_db, get_language_model
 from app.api.history_controller import HistoryController
@@ -17,6 +18,7 @@ app = FastAPI(
     title="Conntour Space Explorer API",
     description="API for browsing and searching NASA space images",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 logger.info("Starting Conntour Space Explorer backend")
@@ -35,12 +37,12 @@ async def startup_event():
     """Initialize infrastructure components on app startup."""
     logger.info("Initializing infrastructure components...")
 
-    # Initialize language model (will be cached by @lru_cache)
+    # Initialize language model (will be cached by @cache)
     logger.info("Initializing language model...")
-    get_language_model()
+    get_language_model().warmup()
     logger.info("Language model initialized")
 
-    # Initialize database (will be cached by @lru_cache)
+    # Initialize database (will be cached by @cache)
     logger.info("Initializing database...")
     get_db()
     logger.info("Database initialized")
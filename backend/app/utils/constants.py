@@ -2,11 +2,32 @@ import os.path
 
 # Data Paths
 MOCK_DATA_JSON = os.path.join("data", "mock_data.json")
-EMBEDDING_CACHE = os.path.join("data", "embeddings_cache.pkl")
+EMBEDDING_CACHE = os.path.join("data", "embeddings_cache.npy")
+LEGACY_EMBEDDING_CACHE = os.path.join("data", "embeddings_cache.pkl")  # Pickled cache, read once to migrate it
 DEFAULT_LOG_PATH = os.path.join("logs", "app.log")
 
 # Embedding
 EMBEDDING_KEY = "embedding"
+EMBEDDING_CACHE_SAVE_INTERVAL = 64  # Embeddings generated between partial cache saves on startup
+EMBEDDING_BATCH_SIZE = 32  # Images embedded per CLIP forward pass on startup
+IMAGE_DOWNLOAD_WORKERS = 16  # Threads downloading images of a batch concurrently
+IMAGE_DOWNLOAD_TIMEOUT = 10  # Seconds to wait for an image host to connect or send data
+QUANTIZED_SCORING_BLOCK_ROWS = 4096  # int8 embedding rows dequantized at a time when scoring
 NORMALIZED_MINIMUM = 0.2
 NORMALIZED_MAXIMUM = 1.0
 NORMALIZED_MEDIAN = (NORMALIZED_MAXIMUM + NORMALIZED_MINIMUM) / 2
+
+# Sources
+SOURCES_CACHE_CONTROL = "public, max-age=60"  # Clients revalidate the sources list with its ETag after this
+
+# Search
+SEARCH_RESULTS_CACHE_SIZE = 256
+TEXT_EMBEDDING_CACHE_SIZE = 512
+VECTOR_INDEXES = ("numpy", "faiss", "hnsw")  # Values of the VECTOR_INDEX environment variable
+HNSW_MIN_SOURCES = 2000  # Below this, VECTOR_INDEX=hnsw uses an exact index instead
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128  # At least the largest search limit (100)
+
+# History
+HISTORY_RESULTS_RETENTION = 50  # Results kept per history item; the history list only shows the top three
@@ -1,18 +1,73 @@
 """Embedding service for generating text embeddings using sentence-transformers."""
+import hashlib
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple, Union
 
 import numpy as np
 import requests
 import torch
 from PIL import Image
+from requests.adapters import HTTPAdapter
 from transformers import CLIPProcessor, CLIPModel
 
-from app.utils.constants import EMBEDDING_CACHE
+from app.utils.constants import EMBEDDING_CACHE, IMAGE_DOWNLOAD_TIMEOUT, IMAGE_DOWNLOAD_WORKERS, LEGACY_EMBEDDING_CACHE
 from app.utils.logger import logger
 
+# Shared by all image downloads, so connections to the image host are reused instead of re-established per image
+_http_session = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=IMAGE_DOWNLOAD_WORKERS, pool_maxsize=IMAGE_DOWNLOAD_WORKERS, max_retries=3)
+_http_session.mount("http://", _http_adapter)
+_http_session.mount("https://", _http_adapter)
+
+# Directory the EMBEDDING_CACHE and LEGACY_EMBEDDING_CACHE paths are relative to
+_cache_dir = os.path.dirname(__file__)
+
+
+def download_image(image_url: str) -> Image.Image:
+    """
+    Download an image and decode it as RGB.
+
+    Args:
+        image_url: The URL of the image.
+
+    Returns:
+        The decoded RGB image.
+    """
+    logger.debug("Downloading image: %s", image_url)
+    response = _http_session.get(image_url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    # PIL needs a seekable file to detect the image format, so the body is read into memory either way
+    return Image.open(BytesIO(response.content)).convert("RGB")
+
+
+def get_embeddings_from_image_urls(model: CLIPModel, processor: CLIPProcessor, image_urls: List[str]) -> np.ndarray:
+    """
+    Get the embeddings of a batch of images, downloading them concurrently and embedding them in one forward pass.
+
+    Args:
+        model: The language model to use for generating embeddings.
+        processor: The processor to use for generating embeddings.
+        image_urls: The URLs of the images to get embeddings from.
+
+    Returns:
+        numpy array of shape (len(image_urls), D) holding the image embeddings in image_urls order.
+    """
+    # Downloads wait on the network and decoding releases the GIL, so images are fetched concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_DOWNLOAD_WORKERS, len(image_urls)))) as executor:
+        images = list(executor.map(download_image, image_urls))
+
+    # Process the images and get their features in a single batch
+    inputs = processor(images=images, return_tensors="pt")
+    with torch.inference_mode():
+        # Extract the visual features (the vectors)
+        image_features = model.get_image_features(**inputs)
+
+    logger.info("Generated embeddings for %s images", len(image_urls))
+    return image_features.float().numpy()
+
 
 def get_embedding_from_image_url(model: CLIPModel, processor: CLIPProcessor, image_url: str) -> np.ndarray:
     """
@@ -26,28 +81,94 @@ def get_embedding_from_image_url(model: CLIPModel, processor: CLIPProcessor, ima
     Returns:
         numpy array representing the image embedding.
     """
-    logger.debug(f"Getting embedding from image URL: {image_url}")
-    response = requests.get(image_url)
-    img = Image.open(BytesIO(response.content)).convert("RGB")
+    return get_embeddings_from_image_urls(model, processor, [image_url])[0]
+
+
+def normalize_embedding(embedding: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize an embedding.
+
+    Args:
+        embedding: The embedding vector.
+
+    Returns:
+        The float32 embedding scaled to unit length; an all-zero embedding is returned unchanged.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetrically quantize embeddings to int8 with one scale per vector.
+
+    Args:
+        embeddings: A vector of shape (D,) or a matrix of shape (N, D).
+
+    Returns:
+        Tuple of (int8 values with the input's shape, float32 scales with one entry per vector) such that
+        values * scales approximates the embeddings.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=-1) / 127
+    # An all-zero vector quantizes to zeros under any scale
+    safe_scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    quantized = np.round(embeddings / np.expand_dims(safe_scales, -1)).astype(np.int8)
+    return quantized, safe_scales
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the indices of the k highest scores, highest first.
+
+    Partitions the scores in O(N) and only sorts the selected k, instead of sorting every score.
+
+    Args:
+        scores: 1-D array of scores.
+        k: Number of indices to return.
+
+    Returns:
+        Indices of the top min(k, len(scores)) scores, sorted by descending score.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def get_embedding_cache_key(image_url: Optional[str]) -> str:
+    """
+    Get the embeddings cache key of an image.
+
+    Keys are derived from the image URL rather than the source position, so reordering or editing the data
+    file only invalidates the embeddings of images that actually changed.
+
+    Args:
+        image_url: The URL of the image.
+
+    Returns:
+        The hex SHA-256 digest of the image URL.
+    """
+    return hashlib.sha256((image_url or "").encode("utf-8")).hexdigest()
 
-    # Process image and get features
-    inputs = processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        # Extract the visual features (the vector)
-        image_features = model.get_image_features(**inputs)
 
-    # Store as a list, so it's JSON serializable later if needed
-    embedding = image_features.numpy().flatten()
-    logger.info(f"Generated embedding for image {image_url}")
-    return embedding
+def _embeddings_cache_dtype(dim: int) -> np.dtype:
+    """Get the record layout of the embeddings cache: the cache key next to the embedding it maps to."""
+    return np.dtype([("key", "S64"), ("embedding", np.float32, (dim,))])
 
 
-def save_embeddings_cache(embeddings: Dict[int, np.ndarray], cache_path: str) -> None:
+def save_embeddings_cache(embeddings: Dict[str, np.ndarray], cache_path: str) -> None:
     """
     Save embeddings to a cache file.
+
+    The cache is a single .npy array of (cache key, embedding) records, so it can be memory-mapped on load
+    instead of being deserialized. It is written to a temporary file first and then moved into place, so an
+    interrupted write never leaves a truncated cache behind.
     
     Args:
-        embeddings: Dictionary mapping source IDs to embedding arrays
+        embeddings: Dictionary mapping cache keys (see get_embedding_cache_key) to L2-normalized embedding arrays
         cache_path: Path to the cache file
     """
     try:
@@ -55,89 +176,116 @@ def save_embeddings_cache(embeddings: Dict[int, np.ndarray], cache_path: str) ->
         # Ensure directory exists
         os.makedirs(os.path.dirname(cache_path), exist_ok=True)
 
-        # Convert numpy arrays to list for JSON serialization, or use pickle
-        # Using pickle for better performance with numpy arrays
-        with open(cache_path, 'wb') as f:
-            pickle.dump(embeddings, f)
+        dim = np.asarray(next(iter(embeddings.values()))).size if embeddings else 0
+        records = np.empty(len(embeddings), dtype=_embeddings_cache_dtype(dim))
+        records["key"] = list(embeddings.keys())
+        for row, embedding in enumerate(embeddings.values()):
+            records["embedding"][row] = np.asarray(embedding).ravel()
+
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, records, allow_pickle=False)
+        os.replace(tmp_path, cache_path)
 
-        logger.info(f"Saved {len(embeddings)} embeddings to cache: {cache_path}")
+        logger.info("Saved %s embeddings to cache: %s", len(embeddings), cache_path)
     except Exception as e:
-        logger.error(f"Failed to save embeddings cache: {e}")
+        logger.error("Failed to save embeddings cache: %s", e)
 
 
-def load_embeddings_cache(cache_path: str) -> Optional[Dict[int, np.ndarray]]:
+def load_embeddings_cache(cache_path: str) -> Optional[Dict[str, np.ndarray]]:
     """
     Load embeddings from a cache file.
-    
+
+    The file is memory-mapped, so the returned embeddings are read-only views paged in by the OS on use
+    rather than copies.
+
     Args:
         cache_path: Path to the cache file
-        
+
     Returns:
-        Dictionary mapping source IDs to embedding arrays, or None if cache doesn't exist
+        Dictionary mapping cache keys to L2-normalized embedding arrays, or None if cache doesn't exist or
+        cannot be used
     """
     logger.info("Loading embedding from cache")
     if not os.path.exists(cache_path):
         return None
 
     try:
-        with open(cache_path, 'rb') as f:
-            embeddings = pickle.load(f)
-
-        logger.info(f"Loaded {len(embeddings)} embeddings from cache: {cache_path}")
-        return embeddings
+        records = np.load(cache_path, mmap_mode="r", allow_pickle=False)
     except Exception as e:
-        logger.error(f"Failed to load embeddings cache: {e}")
+        logger.error("Failed to load embeddings cache: %s", e)
+        return None
+
+    if records.dtype.names != ("key", "embedding") or records.dtype["embedding"].base != np.float32:
+        logger.warning("Ignoring embeddings cache with unsupported layout %s: %s", records.dtype, cache_path)
         return None
 
+    keys = records["key"].astype(str).tolist()
+    embeddings = dict(zip(keys, records["embedding"]))
+    logger.info("Loaded %s embeddings from cache: %s", len(embeddings), cache_path)
+    return embeddings
+
 
-def is_cache_valid(cache_path: str, data_path: str) -> bool:
+def load_legacy_embeddings_cache(cache_path: str) -> Optional[Dict[int, np.ndarray]]:
     """
-    Check if the cache is valid by comparing modification times.
-    
+    Load embeddings from a pickled cache file, as written before the cache became a .npy file.
+
+    These caches map source indices to raw embeddings. The embeddings are normalized here; the index keys
+    are left for the caller to map to cache keys, since that needs the data file.
+
     Args:
-        cache_path: Path to the cache file
-        data_path: Path to the data file
-        
+        cache_path: Path to the pickled cache file
+
     Returns:
-        True if cache exists and is newer than data file, False otherwise
+        Dictionary mapping source indices to L2-normalized embedding arrays, or None if cache doesn't exist
+        or cannot be used
     """
-    logger.info("Checking if the cache is valid")
+    logger.info("Loading embedding from legacy cache")
     if not os.path.exists(cache_path):
-        return False
-
-    if not os.path.exists(data_path):
-        return False
+        return None
 
     try:
-        cache_mtime = os.path.getmtime(cache_path)
-        data_mtime = os.path.getmtime(data_path)
-        return cache_mtime >= data_mtime
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
     except Exception as e:
-        logger.error(f"Error checking cache validity: {e}")
-        return False
+        logger.error("Failed to load legacy embeddings cache: %s", e)
+        return None
+
+    if not isinstance(cache, dict) or not all(isinstance(source_id, int) for source_id in cache):
+        logger.warning("Ignoring legacy embeddings cache with unknown format: %s", cache_path)
+        return None
+    embeddings = {source_id: normalize_embedding(embedding) for source_id, embedding in cache.items()}
+
+    logger.info("Loaded %s embeddings from legacy cache: %s", len(embeddings), cache_path)
+    return embeddings
 
 
-def check_for_cached_embeddings(data_path: str) -> Tuple[str, Optional[Dict[int, np.ndarray]]]:
+def check_for_cached_embeddings() -> Tuple[str, Optional[Dict[Union[str, int], np.ndarray]]]:
     """
     Check for cached embeddings and return the cache path and embeddings.
 
-    Args:
-        data_path: The path to the data file.
+    The cache stays usable when the data file changes: entries are keyed by image URL, so only embeddings
+    of new images are missing from it. Without a cache, the pickled cache of older versions is used
+    instead; the caller then saves it in the current format.
+
+    Since entries are only keyed by URL, an image replaced at the same URL keeps its cached embedding until
+    the cache file is deleted.
 
     Returns:
         Tuple of (cache_path, cached_embeddings). cached_embeddings is None if cache doesn't exist or is invalid.
     """
     logger.info("Checking for cached embeddings")
-    cache_path = os.path.join(os.path.dirname(__file__), EMBEDDING_CACHE)
-    cached_embeddings = None
-    if is_cache_valid(cache_path, data_path):
-        cached_embeddings = load_embeddings_cache(cache_path)
-        if cached_embeddings:
-            logger.info(f"Using cached embeddings for {len(cached_embeddings)} sources")
+    cache_path = os.path.join(_cache_dir, EMBEDDING_CACHE)
+    cached_embeddings = load_embeddings_cache(cache_path)
+    if cached_embeddings is None:
+        legacy_cache_path = os.path.join(_cache_dir, LEGACY_EMBEDDING_CACHE)
+        cached_embeddings = load_legacy_embeddings_cache(legacy_cache_path)
+    if cached_embeddings:
+        logger.info("Using cached embeddings for %s sources", len(cached_embeddings))
     return cache_path, cached_embeddings
 
 
-def calculate_image_and_text_similarity(image_vec: torch.Tensor, text_vec: torch.Tensor) -> float:
+def calculate_image_and_text_similarity(image_vec: np.ndarray, text_vec: np.ndarray) -> float:
     """
     Calculate cosine similarity between an image vector and a text vector.
 
@@ -148,39 +296,7 @@ def calculate_image_and_text_similarity(image_vec: torch.Tensor, text_vec: torch
     Returns:
         Cosine similarity score between -1 and 1.
     """
-    image_vec = image_vec / image_vec.norm(dim=-1, keepdim=True)
-    text_vec = text_vec / text_vec.norm(dim=-1, keepdim=True)
+    image_vec = normalize_embedding(image_vec)
+    text_vec = normalize_embedding(text_vec)
     # Calculate the cosine similarity score
-    score = (text_vec @ image_vec.t()).item()
-    return score
-
-
-def get_image_embedding(
-    model: CLIPModel, 
-    processor: CLIPProcessor, 
-    cached_embeddings: Optional[Dict[int, np.ndarray]], 
-    idx: int, 
-    image_url: Optional[str]
-) -> np.ndarray:
-    """
-    Get the image embedding for a source.
-
-    Args:
-        model: The model to use for generating embeddings.
-        processor: The processor to use for encoding text.
-        cached_embeddings: The cached embeddings.
-        idx: The index of the source.
-        image_url: The URL of the image.
-
-    Returns:
-        numpy array representing the image embedding.
-    """
-    logger.debug(f"Getting image embedding for source {idx}")
-    # Try to load embedding from cache, otherwise generate it
-    if cached_embeddings and idx in cached_embeddings:
-        embedding = cached_embeddings[idx]
-        logger.debug(f"Loaded cached embedding for source {idx}")
-    else:
-        embedding = get_embedding_from_image_url(model, processor, image_url)
-        logger.debug(f"Generated embedding for source {idx}")
-    return embedding
+    return float(np.dot(text_vec, image_vec))
@@ -1,9 +1,13 @@
 """Tests for HistoryService."""
 
+from datetime import datetime
+from unittest.mock import MagicMock
+
 import pytest
 
 from app.domain.models import HistoryResponse, SearchResultHistory, SearchResult
 from app.domain.services.history_service import HistoryService
+from app.utils.constants import HISTORY_RESULTS_RETENTION
 from tests.tests_utils import DummyDB, generate_search_results
 
 
@@ -37,6 +41,22 @@ def test_add_search_result_history(history_service, mock_db):
     assert history_item.time_searched is not None
 
 
+def test_add_search_result_history_keeps_top_results(history_service, mock_db):
+    """Test that only the top HISTORY_RESULTS_RETENTION results are stored."""
+    history_service.add_search_result_history("test query", generate_search_results(HISTORY_RESULTS_RETENTION + 10))
+
+    stored_results = mock_db.search_results_history[0].all_search_results
+    assert [result["id"] for result in stored_results] == list(range(1, HISTORY_RESULTS_RETENTION + 1))
+
+
+def test_add_search_result_history_time_format(history_service, mock_db):
+    """Test that time_searched is stored as an ISO-8601 UTC timestamp with second precision."""
+    history_service.add_search_result_history("test query", generate_search_results(1))
+
+    time_searched = mock_db.search_results_history[0].time_searched
+    assert datetime.strptime(time_searched, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%dT%H:%M:%SZ") == time_searched
+
+
 def test_get_history_empty(history_service):
     """Test getting history when there are no items."""
     response = history_service.get_history()
@@ -111,14 +131,105 @@ def test_get_history_sorted_by_most_recent(history_service, mock_db):
     assert response.items[1].query == "older query"
 
 
-def test_get_history_top_three_images(history_service, mock_db):
-    """Test that only top three images are returned in response."""
+def add_history_items(mock_db, count):
+    """Add `count` history items searched one minute apart, oldest first."""
+    items = []
+    for i in range(count):
+        item = SearchResultHistory(
+            query=f"query {i}",
+            time_searched=f"2024-01-01T00:{i:02d}:00Z",
+            all_search_results=[{"id": 1, "confidence": 0.6}]
+        )
+        mock_db.add_search_result_history(item)
+        items.append(item)
+    return items
+
+
+def test_get_history_pages_are_most_recent_first(history_service, mock_db):
+    """Test that pages walk the history from the most recent search backwards."""
+    add_history_items(mock_db, 5)
+
+    first_page = history_service.get_history(start_index=0, limit=2)
+    last_page = history_service.get_history(start_index=4, limit=2)
+    beyond_total = history_service.get_history(start_index=10, limit=2)
+
+    assert [item.query for item in first_page.items] == ["query 4", "query 3"]
+    assert [item.query for item in last_page.items] == ["query 0"]
+    assert beyond_total.items == []
+    assert beyond_total.total == 5
+
+
+def test_get_history_cursor_walks_all_items(history_service, mock_db):
+    """Test that following next_cursor visits every item once, most recent first."""
+    add_history_items(mock_db, 5)
+    # Two searches in the same second are ordered by ID
+    tied_item = SearchResultHistory(query="tied query", time_searched="2024-01-01T00:02:00Z", all_search_results=[])
+    mock_db.add_search_result_history(tied_item)
+
+    response = history_service.get_history(limit=2)
+    queries = [item.query for item in response.items]
+    while response.next_cursor is not None:
+        response = history_service.get_history(limit=2, cursor=response.next_cursor)
+        queries.extend(item.query for item in response.items)
+
+    assert len(queries) == 6
+    assert queries[:2] == ["query 4", "query 3"]
+    assert set(queries[2:4]) == {"query 2", "tied query"}
+    assert queries[4:] == ["query 1", "query 0"]
+
+
+def test_get_history_cursor_survives_deleted_item(history_service, mock_db):
+    """Test that a cursor still points to the right place after its item is deleted."""
+    items = add_history_items(mock_db, 4)
+    first_page = history_service.get_history(limit=2)
+    history_service.delete_history_item(items[2].id)
+
+    second_page = history_service.get_history(limit=2, cursor=first_page.next_cursor)
+
+    assert [item.query for item in second_page.items] == ["query 1", "query 0"]
+    assert second_page.next_cursor is None
+
+
+def test_get_history_next_cursor_none_on_last_page(history_service, mock_db):
+    """Test that next_cursor is only set while more items remain."""
+    add_history_items(mock_db, 2)
+
+    assert history_service.get_history(limit=2).next_cursor is None
+    assert history_service.get_history(limit=1).next_cursor is not None
+    assert history_service.get_history().next_cursor is None
+
+
+def test_get_history_invalid_cursor(history_service):
+    """Test that a malformed cursor is rejected."""
+    with pytest.raises(ValueError, match="Invalid history cursor"):
+        history_service.get_history(cursor="not a cursor")
+
+
+def test_get_history_only_builds_responses_for_requested_page(history_service, monkeypatch):
+    """Test that only the paginated slice is converted into response models."""
+    for i in range(5):
+        history_service.add_search_result_history(f"query {i}", generate_search_results(1))
+    spy = MagicMock(wraps=history_service.create_search_results_history_response)
+    monkeypatch.setattr(history_service, "create_search_results_history_response", spy)
+
+    response = history_service.get_history(start_index=1, limit=2)
+
+    assert response.total == 5
+    assert spy.call_count == 2
+
+
+def test_get_history_top_three_images(history_service, mock_db, monkeypatch):
+    """Test that only top three images are returned in response, without looking up sources."""
     # Add history with 5 results
     results = generate_search_results(5)
     history_service.add_search_result_history("test query", results)
+    get_sources_by_ids = MagicMock(wraps=mock_db.get_sources_by_ids)
+    monkeypatch.setattr(mock_db, "get_sources_by_ids", get_sources_by_ids)
 
     response = history_service.get_history()
 
+    assert get_sources_by_ids.call_count == 0
+
     assert len(response.items) == 1
     assert len(response.items[0].top_three_images) == 3
     # Verify the top three are the first three results
@@ -171,6 +282,8 @@ def test_delete_history_item_multiple_items(history_service, mock_db):
     # Verify the correct item was deleted
     remaining_ids = [item.id for item in mock_db.search_results_history]
     assert target_id not in remaining_ids
+    # The ID index stays in sync with the history list
+    assert set(mock_db._history_by_id) == set(remaining_ids)
 
 
 def test_create_search_results_history_response(history_service, mock_db):
@@ -198,14 +311,18 @@ def test_create_search_results_history_response(history_service, mock_db):
     assert response.top_three_images[2].id == results[2].id
 
 
-def test_get_history_results_success(history_service, mock_db):
+def test_get_history_results_success(history_service, mock_db, monkeypatch):
     """Test successfully getting history results by ID."""
     results = generate_search_results(5)
     history_service.add_search_result_history("test query", results)
+    get_sources_by_ids = MagicMock(wraps=mock_db.get_sources_by_ids)
+    monkeypatch.setattr(mock_db, "get_sources_by_ids", get_sources_by_ids)
     
     history_id = mock_db.search_results_history[0].id
     retrieved_results = history_service.get_history_results(history_id)
     
+    # All sources are fetched in one bulk lookup
+    assert get_sources_by_ids.call_count == 1
     assert len(retrieved_results) == 5
     # Verify that results were reconstructed as SearchResult objects
     assert all(isinstance(result, SearchResult) for result in retrieved_results)
@@ -217,3 +334,16 @@ def test_get_history_results_not_found(history_service):
     """Test getting history results for non-existent ID."""
     with pytest.raises(ValueError, match="History item with ID.*not found"):
         history_service.get_history_results("non-existent-id")
+
+
+def test_get_history_results_skips_missing_sources(history_service, mock_db):
+    """Test that results whose source is no longer in the database are skipped, keeping the stored order."""
+    results = generate_search_results(3)
+    results[1].id = 99
+    history_service.add_search_result_history("test query", results)
+
+    history_id = mock_db.search_results_history[0].id
+    retrieved_results = history_service.get_history_results(history_id)
+
+    assert [r.id for r in retrieved_results] == [1, 3]
+    assert [r.confidence for r in retrieved_results] == [results[0].confidence, results[2].confidence]
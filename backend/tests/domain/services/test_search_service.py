@@ -1,16 +1,13 @@
 from unittest.mock import MagicMock
 
+import numpy as np
 import pytest
 import torch
 
 from app.domain.models import SearchResult
 from app.domain.services import search_service
 from app.domain.services.history_service import HistoryService
-from app.domain.services.search_service import (
-    SearchService,
-    normalize_results,
-    calculate_similarity_for_one_source,
-)
+from app.domain.services.search_service import SearchService, normalize_results
 from app.utils.constants import NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM, NORMALIZED_MEDIAN
 from tests.tests_utils import DummyDB
 
@@ -58,40 +55,9 @@ def test_normalize_results_all_same_score():
         assert r.confidence == NORMALIZED_MEDIAN
 
 
-def test_calculate_similarity_for_one_source_returns_search_result(monkeypatch):
-    dummy_embedding = [1.0, 2.0, 3.0]
-    source_dict = {
-        "id": "1",
-        "name": "Apollo",
-        "type": "Mission",
-        "launch_date": "1969-07-16",
-        "description": "Test",
-        "image_url": "url",
-        "status": "Active",
-        "embedding": dummy_embedding
-    }
-    text_vec = torch.tensor([[1.0, 2.0, 3.0]])
-
-    # Patch EMBEDDING_KEY used in the function
-    monkeypatch.setattr(search_service, 'EMBEDDING_KEY', "embedding")
-    # Patch the similarity function to return a fixed value
-    monkeypatch.setattr(search_service, 'calculate_image_and_text_similarity', lambda img, txt: 0.8)
-
-    result = calculate_similarity_for_one_source(source_dict, text_vec)
-    assert isinstance(result, SearchResult)
-    assert result.confidence == 80.0
-    assert result.name == "Apollo"
-
-
 def test_search_service_search_returns_normalized_results_sorted(mock_db, mock_lm, monkeypatch):
-    # Patch calculate_image_and_text_similarity to make the results deterministic
-    similarity_scores = [0.9, 0.1]
-
-    def fake_similarity(img, txt):
-        # For this test we just pop one for each call
-        return similarity_scores.pop(0)
-
-    monkeypatch.setattr(search_service, 'calculate_image_and_text_similarity', fake_similarity)
+    # Patch score_all to make the results deterministic
+    monkeypatch.setattr(mock_db, 'score_all', lambda text_vec: np.array([0.1, 0.9], dtype=np.float32))
 
     hs = HistoryService(db=mock_db)
     svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
@@ -101,8 +67,53 @@ def test_search_service_search_returns_normalized_results_sorted(mock_db, mock_l
     # Scores should be 90.0, 10.0, then normalized to [NORMALIZED_MINIMUM, NORMALIZED_MAXIMUM]
     assert results[0].confidence > results[1].confidence
     assert all(NORMALIZED_MINIMUM <= r.confidence <= NORMALIZED_MAXIMUM for r in results)
-    # Names should correspond to mock data
-    assert results[0].name in ["Apollo 11", "Voyager 1"]
+    # The highest score belongs to the second embedded source
+    assert results[0].name == "Voyager 1"
+
+
+def test_scale_confidences():
+    scaled = search_service.scale_confidences(np.array([0.0, 50.0, 100.0]), 0.0, 100.0)
+    np.testing.assert_allclose(scaled, [NORMALIZED_MINIMUM, NORMALIZED_MEDIAN, NORMALIZED_MAXIMUM])
+    # An empty range maps everything to the median
+    assert search_service.scale_confidences(np.array([5.0, 5.0]), 5.0, 5.0).tolist() == [NORMALIZED_MEDIAN] * 2
+
+
+def test_normalize_results_large_batch():
+    confidences = np.random.default_rng(0).uniform(0, 100, 10_000)
+    results = [
+        SearchResult.model_construct(id=i, name="A", type="Type", launch_date="x", description="a", image_url="url",
+                                     status="done", confidence=float(confidence))
+        for i, confidence in enumerate(confidences)
+    ]
+    norm = normalize_results(results)
+    normalized = np.array([r.confidence for r in norm])
+    assert normalized.min() == pytest.approx(NORMALIZED_MINIMUM)
+    assert normalized.max() == pytest.approx(NORMALIZED_MAXIMUM)
+    # Rescaling keeps the order of the scores
+    assert (np.argsort(normalized, kind="stable") == np.argsort(confidences, kind="stable")).all()
+
+
+def test_normalize_results_empty_list():
+    assert normalize_results([]) == []
+
+
+def test_normalize_results_with_explicit_range():
+    results = [
+        SearchResult(id="1", name="A", type="Type", launch_date="x", description="a", image_url="url", status="done",
+                     confidence=50.0),
+    ]
+    norm = normalize_results(results, min_confidence=0.0, max_confidence=100.0)
+    assert norm[0].confidence == pytest.approx((NORMALIZED_MINIMUM + NORMALIZED_MAXIMUM) / 2)
+
+
+def test_search_service_search_scales_top_results_against_all_scores(mock_db, mock_lm, monkeypatch):
+    monkeypatch.setattr(mock_db, 'score_all', lambda text_vec: np.array([0.5, 0.9], dtype=np.float32))
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    results = svc.search("moon mission", limit=1)
+    # Only the best source is returned, and it is still scaled against the lowest score overall
+    assert [r.name for r in results] == ["Voyager 1"]
+    assert results[0].confidence == NORMALIZED_MAXIMUM
 
 
 def test_search_service_search_empty_query_returns_empty_list(mock_db, mock_lm):
@@ -116,8 +127,11 @@ def test_search_service_search_adds_search_result_history(mock_db, mock_lm, monk
     hs = HistoryService(db=mock_db)
     svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
     svc.search("moon mission", limit=2)
-    assert len(mock_db.get_all_search_results_history()) == 1
-    history_item = mock_db.get_all_search_results_history()[0]
+    history = mock_db.get_all_search_results_history()
+    # Searching never reads the whole history, only the snapshot above did
+    assert mock_db.history_scans == 1
+    assert len(history) == 1
+    history_item = history[0]
     assert history_item.query == "moon mission"
     assert len(history_item.all_search_results) == 2
     # all_search_results is now a list of dicts with 'id' and 'confidence'
@@ -126,3 +140,64 @@ def test_search_service_search_adds_search_result_history(mock_db, mock_lm, monk
     # Verify confidence scores are stored
     assert "confidence" in history_item.all_search_results[0]
     assert "confidence" in history_item.all_search_results[1]
+
+
+def test_normalize_query():
+    assert search_service.normalize_query("  Moon   Mission ") == "moon mission"
+
+
+def test_search_service_search_uses_cached_results(mock_db, mock_lm):
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    first = svc.search("moon mission", limit=2)
+    second = svc.search("  Moon  Mission", limit=2)
+    # The text is encoded once; the second, equivalent query is served from the cache
+    assert mock_lm.model.get_text_features.call_count == 1
+    assert [r.id for r in second] == [r.id for r in first]
+    # Both searches are still recorded in history, under their original query
+    assert {h.query for h in mock_db.get_all_search_results_history()} == {"moon mission", "  Moon  Mission"}
+
+
+def test_search_service_cached_results_are_not_shared(mock_db, mock_lm):
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    first = svc.search("moon mission", limit=2)
+    confidences = [r.confidence for r in first]
+    first[0].confidence = -1.0
+
+    second = svc.search("moon mission", limit=2)
+    # The cached results and the history entries keep their original values
+    assert [r.confidence for r in second] == confidences
+    assert [h.top_three_images[0].confidence for h in mock_db.search_results_history] == [confidences[0]] * 2
+
+
+def test_search_service_search_cache_is_per_limit(mock_db, mock_lm):
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    assert len(svc.search("moon mission", limit=1, save_to_history=False)) == 1
+    assert len(svc.search("moon mission", limit=2, save_to_history=False)) == 2
+    # Results are ranked again for the new limit, but the text embedding is reused
+    assert mock_lm.model.get_text_features.call_count == 1
+
+
+def test_search_service_text_embedding_cache(mock_db, mock_lm):
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    first = svc._encode_text("Moon Mission")
+    second = svc._encode_text("moon   mission")
+    assert second is first
+    assert mock_lm.model.get_text_features.call_count == 1
+    # The cached embedding is L2-normalized and protected from in-place changes
+    assert np.linalg.norm(first) == pytest.approx(1.0)
+    assert not first.flags.writeable
+    svc._encode_text("solar flares")
+    assert mock_lm.model.get_text_features.call_count == 2
+
+
+def test_search_service_encodes_reduced_precision_text_features_as_float32(mock_db, mock_lm):
+    mock_lm.model.get_text_features.return_value = torch.tensor([[0.1, 0.2, 0.3]], dtype=torch.bfloat16)
+    hs = HistoryService(db=mock_db)
+    svc = SearchService(db=mock_db, lm=mock_lm, history_service=hs)
+    text_vec = svc._encode_text("moon mission")
+    assert text_vec.dtype == np.float32
+    assert len(svc.search("moon mission", limit=2, save_to_history=False)) == 2
@@ -1,3 +1,4 @@
+import orjson
 import pytest
 
 from app.domain.models import Source
@@ -26,7 +27,31 @@ def test_sources_service_returns_empty_list_when_no_sources():
         def get_all_sources(self):
             return []
 
+        def get_all_source_models(self):
+            return []
+
     svc = SourcesService(db=EmptyDB())
     result = svc.get_all_sources()
     assert isinstance(result, list)
     assert result == []
+
+
+def test_sources_service_etag_is_stable(dummy_db):
+    svc = SourcesService(db=dummy_db)
+    etag = svc.get_sources_etag()
+    assert etag.startswith('"') and etag.endswith('"')
+    assert svc.get_sources_etag() == etag
+    assert SourcesService(db=DummyDB(include_embeddings=True)).get_sources_etag() == etag
+
+
+def test_sources_service_etag_changes_with_sources(dummy_db):
+    etag = SourcesService(db=dummy_db).get_sources_etag()
+    dummy_db.sources[0]["name"] = "Apollo 12"
+    assert SourcesService(db=dummy_db).get_sources_etag() != etag
+
+
+def test_sources_service_json_is_encoded_once(dummy_db):
+    svc = SourcesService(db=dummy_db)
+    sources_json = svc.get_sources_json()
+    assert orjson.loads(sources_json) == [source.model_dump(mode="json") for source in svc.get_all_sources()]
+    assert svc.get_sources_json() is sources_json
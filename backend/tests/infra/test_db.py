@@ -1,15 +1,22 @@
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import orjson
 import pytest
 
-from app.domain.models import SearchResultHistory
+from app.domain.models import SearchResultHistory, Source
 from app.infra.db import SpaceDB
 from app.utils.constants import EMBEDDING_KEY
+from app.utils.embedding_utils import get_embedding_cache_key, normalize_embedding
+from app.utils.logger import logger
 from tests import tests_utils
 from tests.tests_utils import DummyLM
 
 
-@pytest.fixture
-def sample_json_data(tmp_path):
-    """Create a temporary mock_data.json file for testing."""
+def write_sample_json_data(directory):
+    """Write a mock_data.json file with two sources to a directory and return its path."""
     data = {
         "collection": {
             "items": [
@@ -36,51 +43,64 @@ def sample_json_data(tmp_path):
     }
     import json
     # Overwrite MOCK_DATA_JSON to point to our temporary file
-    mock_json = tmp_path / "mock_data.json"
+    mock_json = directory / "mock_data.json"
     with open(mock_json, "w", encoding="utf-8") as f:
         json.dump(data, f)
     return mock_json
 
 
-@pytest.fixture(autouse=True)
-def patch_mock_data_json(monkeypatch, sample_json_data):
-    """Patch the data file path to use the temporary test file."""
-    from app.utils import embedding_utils
-    import numpy as np
-
-    # Patch the file opening to use our test file
-    original_open = open
-
-    def patched_open(file_path, *args, **kwargs):
-        if "mock_data.json" in str(file_path):
-            return original_open(sample_json_data, *args, **kwargs)
-        return original_open(file_path, *args, **kwargs)
+def patch_space_db(monkeypatch, sample_json_data):
+    """Patch SpaceDB to load the sample data file, with dummy embeddings and no cache file."""
+    from app.infra import db
 
-    monkeypatch.setattr("builtins.open", patched_open)
+    # The data path is joined onto the package directory, which keeps an absolute path as is
+    monkeypatch.setattr(db, "MOCK_DATA_JSON", str(sample_json_data))
 
     # Patch check_for_cached_embeddings to return no cache for tests
-    def mock_check_for_cached_embeddings(data_path):
+    def mock_check_for_cached_embeddings():
         return str(sample_json_data.parent / "embeddings_cache.pkl"), None
 
-    monkeypatch.setattr(embedding_utils, "check_for_cached_embeddings", mock_check_for_cached_embeddings)
+    monkeypatch.setattr(db, "check_for_cached_embeddings", mock_check_for_cached_embeddings)
 
-    # Patch get_image_embedding to return dummy embeddings
-    def mock_get_image_embedding(model, processor, cached_embeddings, idx, image_url):
-        # Return a dummy embedding array
-        return np.array([0.1 * idx, 0.2 * idx, 0.3 * idx], dtype=np.float32)
+    # Patch get_embeddings_from_image_urls to return dummy embeddings
+    def mock_get_embeddings_from_image_urls(model, processor, image_urls):
+        return np.array([[0.1 * idx, 0.2 * idx, 0.3 * idx] for idx in range(1, len(image_urls) + 1)],
+                        dtype=np.float32)
 
-    monkeypatch.setattr(embedding_utils, "get_image_embedding", mock_get_image_embedding)
+    monkeypatch.setattr(db, "get_embeddings_from_image_urls", mock_get_embeddings_from_image_urls)
 
     # Patch save_embeddings_cache to do nothing in tests
     def mock_save_embeddings_cache(embeddings, cache_path):
         pass
 
-    monkeypatch.setattr(embedding_utils, "save_embeddings_cache", mock_save_embeddings_cache)
+    monkeypatch.setattr(db, "save_embeddings_cache", mock_save_embeddings_cache)
 
 
-def test_db_get_all_sources():
-    db = SpaceDB(lm=DummyLM())
-    sources = db.get_all_sources()
+@pytest.fixture
+def sample_json_data(tmp_path):
+    """Create a temporary mock_data.json file for testing."""
+    return write_sample_json_data(tmp_path)
+
+
+@pytest.fixture(autouse=True)
+def patch_mock_data_json(monkeypatch, sample_json_data):
+    """Patch the data file path to use the temporary test file."""
+    patch_space_db(monkeypatch, sample_json_data)
+
+
+@pytest.fixture(scope="module")
+def space_db(tmp_path_factory):
+    """A SpaceDB built once for the tests that only read from it."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        patch_space_db(monkeypatch, write_sample_json_data(tmp_path_factory.mktemp("data")))
+        db = SpaceDB(lm=DummyLM())
+    # Sharing is only safe as long as nothing can modify the embeddings
+    assert not db._emb_matrix.flags.writeable
+    return db
+
+
+def test_db_get_all_sources(space_db):
+    sources = space_db.get_all_sources()
     assert isinstance(sources, list)
     assert len(sources) == 2
     assert sources[0]["name"] == "Test Source 1"
@@ -90,18 +110,217 @@ def test_db_get_all_sources():
     assert EMBEDDING_KEY not in sources[1]
 
 
-def test_db_get_all_sources_with_embedding():
+def test_db_stores_embeddings_as_one_normalized_matrix(space_db):
+    assert space_db._emb_matrix.shape == (2, 3)
+    assert space_db._emb_matrix.dtype == np.float32
+    assert space_db._emb_matrix.flags.c_contiguous
+    np.testing.assert_allclose(np.linalg.norm(space_db._emb_matrix, axis=1), [1.0, 1.0], rtol=1e-6)
+    # Sources only carry metadata
+    assert all(EMBEDDING_KEY not in source for source in space_db.get_embedded_sources())
+
+
+def test_db_score_all_returns_cosine_similarity_per_source(space_db):
+    text_vec = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    scores = space_db.score_all(text_vec)
+    assert scores.shape == (2,)
+    # Both dummy embeddings point the same way, (0.1, 0.2, 0.3) * idx
+    np.testing.assert_allclose(scores, [0.1 / np.linalg.norm([0.1, 0.2, 0.3])] * 2, rtol=1e-5)
+    assert [source["name"] for source in space_db.get_embedded_sources()] == ["Test Source 1", "Test Source 2"]
+    assert EMBEDDING_KEY not in space_db.get_embedded_sources()[0]
+
+
+def test_db_int8_scores_match_float32_within_tolerance():
+    text_vec = np.array([0.6, 0.0, 0.8], dtype=np.float32)
+    expected = SpaceDB(lm=DummyLM()).score_all(text_vec)
+    db = SpaceDB(lm=DummyLM(), quantize=True)
+    assert db._emb_q.dtype == np.int8
+    assert db._emb_matrix is None
+    np.testing.assert_allclose(db.score_all(text_vec), expected, atol=0.01)
+
+
+def test_db_search_by_embedding_returns_top_sources_and_lowest_score(space_db):
+    text_vec = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    scores = space_db.score_all(text_vec)
+    top_scores, top_indices, min_score = space_db.search_by_embedding(text_vec, 1)
+    assert len(top_indices) == 1
+    np.testing.assert_allclose(top_scores, [scores.max()])
+    np.testing.assert_allclose(scores[top_indices], top_scores)
+    assert min_score == pytest.approx(float(scores.min()))
+
+
+def test_db_rejects_unknown_vector_index():
+    with pytest.raises(ValueError):
+        SpaceDB(lm=DummyLM(), vector_index="annoy")
+
+
+@pytest.mark.parametrize("vector_index", ["faiss", "hnsw"])
+def test_db_faiss_index_requires_faiss(monkeypatch, vector_index):
+    monkeypatch.setattr("app.infra.db.faiss", None)
+    with pytest.raises(ValueError):
+        SpaceDB(lm=DummyLM(), vector_index=vector_index)
+
+
+@pytest.fixture
+def many_sources(tmp_path, monkeypatch):
+    """Patch SpaceDB to load 50 sources with distinct random embeddings."""
+    from app.infra import db
+
+    data = {"collection": {"items": [
+        {"data": [{"title": f"Source {idx}"}], "links": [{"render": "image", "href": f"http://example.com/{idx}.jpg"}]}
+        for idx in range(50)
+    ]}}
+    data_path = tmp_path / "many_sources.json"
+    data_path.write_bytes(orjson.dumps(data))
+    monkeypatch.setattr(db, "MOCK_DATA_JSON", str(data_path))
+
+    def mock_get_embeddings_from_image_urls(model, processor, image_urls):
+        return np.stack([np.random.default_rng(int(url.rsplit("/", 1)[1].split(".")[0])).standard_normal(8)
+                         for url in image_urls]).astype(np.float32)
+
+    monkeypatch.setattr(db, "get_embeddings_from_image_urls", mock_get_embeddings_from_image_urls)
+
+
+@pytest.mark.usefixtures("many_sources")
+def test_db_faiss_index_matches_numpy_search():
+    pytest.importorskip("faiss")
+    numpy_db = SpaceDB(lm=DummyLM(), vector_index="numpy")
+    faiss_db = SpaceDB(lm=DummyLM(), vector_index="faiss")
+    text_vec = normalize_embedding(np.random.default_rng(99).standard_normal(8))
+
+    expected_scores, expected_indices, expected_min = numpy_db.search_by_embedding(text_vec, 10)
+    top_scores, top_indices, min_score = faiss_db.search_by_embedding(text_vec, 10)
+
+    assert top_indices.tolist() == expected_indices.tolist()
+    np.testing.assert_allclose(top_scores, expected_scores, atol=1e-5)
+    assert min_score == pytest.approx(expected_min, abs=1e-5)
+    # A limit above the number of sources returns every source
+    assert len(faiss_db.search_by_embedding(text_vec, 100)[1]) == 50
+
+
+@pytest.mark.usefixtures("many_sources")
+def test_db_hnsw_index_returns_found_sources_by_score(monkeypatch):
+    faiss = pytest.importorskip("faiss")
+    monkeypatch.setattr("app.infra.db.HNSW_MIN_SOURCES", 10)
+    db = SpaceDB(lm=DummyLM(), vector_index="hnsw")
+    assert isinstance(db._index, faiss.IndexHNSWFlat)
+    text_vec = normalize_embedding(np.random.default_rng(99).standard_normal(8))
+
+    # Asking for every source makes the graph walk pad with -1 if it misses some
+    top_scores, top_indices, min_score = db.search_by_embedding(text_vec, 50)
+
+    assert len(top_indices) > 0
+    assert (top_indices >= 0).all()
+    assert len(set(top_indices.tolist())) == len(top_indices)
+    assert (np.diff(top_scores) <= 1e-6).all()
+    np.testing.assert_allclose(top_scores, db.score_all(text_vec)[top_indices], atol=1e-5)
+    assert min_score <= top_scores[-1] + 1e-6
+
+
+def test_db_score_all_stays_within_cosine_range():
+    db = SpaceDB(lm=DummyLM(), quantize=True)
+    # Scoring an embedding against itself is exactly 1 in theory, but int8 rounding can overshoot
+    scores = db.score_all(db._emb_q[0] * db._emb_scales[0])
+    assert scores.max() <= 1.0
+    assert scores.min() >= -1.0
+
+
+def test_db_int8_scores_are_independent_of_block_size(monkeypatch):
+    text_vec = np.array([0.6, 0.0, 0.8], dtype=np.float32)
+    db = SpaceDB(lm=DummyLM(), quantize=True)
+    expected = db.score_all(text_vec)
+    monkeypatch.setattr("app.infra.db.QUANTIZED_SCORING_BLOCK_ROWS", 1)
+    np.testing.assert_allclose(db.score_all(text_vec), expected, rtol=1e-6)
+
+
+def test_db_quantization_from_environment(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_QUANTIZATION", "int8")
+    assert SpaceDB(lm=DummyLM())._emb_q is not None
+    monkeypatch.setenv("EMBEDDING_QUANTIZATION", "int4")
+    with pytest.raises(ValueError, match="Unsupported EMBEDDING_QUANTIZATION"):
+        SpaceDB(lm=DummyLM())
+
+
+def test_db_get_sources_by_ids_returns_shared_source_models(space_db):
+    sources = space_db.get_sources_by_ids([2, 99])
+    # Unknown IDs are skipped
+    assert list(sources.keys()) == [2]
+    assert isinstance(sources[2], Source)
+    assert sources[2].name == "Test Source 2"
+    # The same model instance is returned on every lookup
+    assert space_db.get_sources_by_ids([2])[2] is sources[2]
+
+
+def test_db_get_all_source_models_are_built_once(space_db):
+    models = space_db.get_all_source_models()
+    assert [model.name for model in models] == ["Test Source 1", "Test Source 2"]
+    assert all(isinstance(model, Source) for model in models)
+    # The same models back every call and the ID lookups
+    assert space_db.get_all_source_models()[0] is models[0]
+    assert space_db.get_sources_by_ids([1])[1] is models[0]
+
+
+def test_db_embeds_missing_images_in_batches(monkeypatch):
+    from app.infra import db as db_module
+
+    batches = []
+
+    def record_batches(model, processor, image_urls):
+        batches.append(list(image_urls))
+        return np.array([[0.6, 0.8, 0.0]] * len(image_urls), dtype=np.float32)
+
+    monkeypatch.setattr(db_module, "get_embeddings_from_image_urls", record_batches)
+    SpaceDB(lm=DummyLM())
+    assert batches == [["http://example.com/img1.jpg", "http://example.com/img2.jpg"]]
+
+    batches.clear()
+    monkeypatch.setattr(db_module, "EMBEDDING_BATCH_SIZE", 1)
     db = SpaceDB(lm=DummyLM())
-    sources = db.get_all_sources_with_embedding()
-    assert isinstance(sources, list)
-    assert len(sources) == 2
-    assert EMBEDDING_KEY in sources[0]
-    assert EMBEDDING_KEY in sources[1]
+    assert batches == [["http://example.com/img1.jpg"], ["http://example.com/img2.jpg"]]
+    assert [source["name"] for source in db.get_embedded_sources()] == ["Test Source 1", "Test Source 2"]
+
+
+def test_db_rekeys_index_keyed_cache_by_image_url(monkeypatch):
+    from app.infra import db as db_module
 
+    cached_embedding = np.array([0.6, 0.8, 0.0], dtype=np.float32)
+    monkeypatch.setattr(db_module, "check_for_cached_embeddings",
+                        lambda: ("cache.npy", {1: cached_embedding}))
+    saved_caches = []
+    monkeypatch.setattr(db_module, "save_embeddings_cache",
+                        lambda embeddings, cache_path: saved_caches.append(dict(embeddings)))
+    embedded_urls = []
+
+    def new_embeddings(model, processor, image_urls):
+        embedded_urls.extend(image_urls)
+        return np.array([[0.0, 0.0, 1.0]] * len(image_urls), dtype=np.float32)
+
+    monkeypatch.setattr(db_module, "get_embeddings_from_image_urls", new_embeddings)
 
-def test_db_source_fields():
     db = SpaceDB(lm=DummyLM())
-    sources = db.get_all_sources()
+    # Source 1 reuses the embedding cached under its index; the cache is saved again keyed by image URL
+    assert embedded_urls == ["http://example.com/img2.jpg"]
+    np.testing.assert_allclose(db.score_all(cached_embedding)[0], 1.0, rtol=1e-6)
+    assert len(saved_caches) == 1
+    assert set(saved_caches[0]) == {get_embedding_cache_key("http://example.com/img1.jpg"),
+                                    get_embedding_cache_key("http://example.com/img2.jpg")}
+
+
+def test_db_saves_embeddings_cache_while_processing(monkeypatch):
+    from app.infra import db as db_module
+
+    monkeypatch.setattr(db_module, "EMBEDDING_BATCH_SIZE", 1)
+    monkeypatch.setattr(db_module, "EMBEDDING_CACHE_SAVE_INTERVAL", 1)
+    saved_caches = []
+    monkeypatch.setattr(db_module, "save_embeddings_cache",
+                        lambda embeddings, cache_path: saved_caches.append(dict(embeddings)))
+
+    SpaceDB(lm=DummyLM())
+    # A partial save after each generated embedding, then the final save
+    assert [len(cache) for cache in saved_caches] == [1, 2, 2]
+
+
+def test_db_source_fields(space_db):
+    sources = space_db.get_all_sources()
     for source in sources:
         assert {"id", "name", "type", "launch_date", "description", "image_url", "status"}.issubset(source.keys())
 
@@ -129,3 +348,117 @@ def test_db_add_search_result_history():
     # Verify structure: list of dicts with 'id' and 'confidence'
     assert all(isinstance(result, dict) for result in search_results_history[0].all_search_results)
     assert all("id" in result and "confidence" in result for result in search_results_history[0].all_search_results)
+
+
+def test_db_get_search_result_history_by_id():
+    db = SpaceDB(lm=DummyLM())
+    results = tests_utils.generate_search_results(2)
+    results_data = [{"id": result.id, "confidence": result.confidence} for result in results]
+    search_result_history = SearchResultHistory(query="test", time_searched="2020-01-01T00:00:00Z",
+                                                all_search_results=results_data)
+    db.add_search_result_history(search_result_history)
+    assert db.get_search_result_history_by_id(search_result_history.id) is search_result_history
+    with pytest.raises(ValueError, match="History item with ID.*not found"):
+        db.get_search_result_history_by_id("non-existent-id")
+
+
+def test_db_delete_search_result_history():
+    db = SpaceDB(lm=DummyLM())
+    search_result_history = SearchResultHistory(query="test", time_searched="2020-01-01T00:00:00Z",
+                                                all_search_results=[])
+    db.add_search_result_history(search_result_history)
+    assert db.delete_search_result_history(search_result_history.id) is True
+    assert db.get_all_search_results_history() == []
+    assert db.delete_search_result_history(search_result_history.id) is False
+    with pytest.raises(ValueError):
+        db.get_search_result_history_by_id(search_result_history.id)
+
+
+def test_db_delete_search_result_history_keeps_order():
+    db = SpaceDB(lm=DummyLM())
+    items = [SearchResultHistory(query=f"query {minute}", time_searched=f"2024-01-01T00:0{minute}:00Z",
+                                 all_search_results=[]) for minute in range(4)]
+    for item in items:
+        db.add_search_result_history(item)
+
+    assert db.delete_search_result_history(items[1].id) is True
+    assert [item.query for item in db.get_all_search_results_history()] == ["query 0", "query 2", "query 3"]
+    # Pagination by key still sees the remaining items only
+    assert [item.query for item in db.get_search_results_history_before(items[3].sort_key, 5)] == [
+        "query 2", "query 0"]
+
+
+def test_db_delete_search_result_history_only_removes_the_requested_item():
+    db = SpaceDB(lm=DummyLM())
+    items = [SearchResultHistory(query=f"query {minute}", time_searched=f"2024-01-01T00:0{minute}:00Z",
+                                 all_search_results=[]) for minute in range(3)]
+    for item in items:
+        db.add_search_result_history(item)
+    # Even if the item is not where its sort key says, no other item is deleted
+    db._search_results_history[0], db._search_results_history[1] = items[1], items[0]
+
+    assert db.delete_search_result_history(items[0].id) is True
+    assert [item.query for item in db.get_all_search_results_history()] == ["query 1", "query 2"]
+
+
+def test_db_concurrent_adds_keep_history_aligned_and_sorted(caplog):
+    db = SpaceDB(lm=DummyLM())
+    # Keep the thousands of per-add INFO lines out of the log file
+    caplog.set_level(logging.WARNING, logger=logger.name)
+
+    def add_history(worker):
+        for i in range(5000):
+            # Times go back and forth, so both the append and the insert paths run
+            db.add_search_result_history(SearchResultHistory(
+                query=f"query {worker}-{i}", time_searched=f"2024-01-01T00:{i % 60:02d}:{worker:02d}Z",
+                all_search_results=[]))
+
+    # Switch threads as often as possible, so unguarded updates would interleave
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(add_history, range(8)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    history = db.get_all_search_results_history()
+    assert len(history) == 8 * 5000
+    assert db._search_results_history_keys == [item.sort_key for item in history]
+    assert db._search_results_history_keys == sorted(db._search_results_history_keys)
+    assert len(db._search_results_history_by_id) == len(history)
+
+
+def test_db_get_search_results_history_before():
+    db = SpaceDB(lm=DummyLM())
+    # Added out of order: the database keeps history ordered by time searched
+    for minute in [1, 3, 0, 2]:
+        db.add_search_result_history(SearchResultHistory(query=f"query {minute}",
+                                                         time_searched=f"2024-01-01T00:0{minute}:00Z",
+                                                         all_search_results=[]))
+
+    newest = db.get_search_results_history_before(None, 2)
+    assert [item.query for item in newest] == ["query 3", "query 2"]
+    older = db.get_search_results_history_before(newest[-1].sort_key, 5)
+    assert [item.query for item in older] == ["query 1", "query 0"]
+    assert [item.query for item in db.get_all_search_results_history()] == [f"query {m}" for m in range(4)]
+
+
+def test_db_get_search_results_history_page():
+    db = SpaceDB(lm=DummyLM())
+    for minute in range(5):
+        db.add_search_result_history(SearchResultHistory(query=f"query {minute}",
+                                                         time_searched=f"2024-01-01T00:0{minute}:00Z",
+                                                         all_search_results=[]))
+
+    assert db.count_search_results_history() == 5
+    assert [item.query for item in db.get_search_results_history_page(0, 2)] == ["query 4", "query 3"]
+    assert [item.query for item in db.get_search_results_history_page(4, 2)] == ["query 0"]
+    assert db.get_search_results_history_page(5, 2) == []
+
+
+def test_db_process_one_source_defaults_for_bare_item(space_db):
+    source = space_db.process_one_source(7, {"data": [], "links": [{"render": "video", "href": "http://v.mp4"}]})
+    assert source["name"] == "NASA Item 7"
+    assert source["type"] == "unknown"
+    assert source["image_url"] is None
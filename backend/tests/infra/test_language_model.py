@@ -0,0 +1,58 @@
+import pytest
+import torch
+from transformers import CLIPConfig, CLIPModel
+
+from app.infra import language_model
+from app.infra.language_model import LanguageModel
+
+
+@pytest.fixture(autouse=True)
+def patch_pretrained(monkeypatch):
+    """Replace the pretrained CLIP weights with a tiny randomly initialized model."""
+    config = CLIPConfig(
+        text_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=2,
+                         projection_dim=16),
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=2,
+                           image_size=32, patch_size=16),
+        projection_dim=16,
+    )
+    monkeypatch.setattr(language_model.CLIPModel, "from_pretrained", lambda name: CLIPModel(config).eval())
+    monkeypatch.setattr(language_model.CLIPProcessor, "from_pretrained", lambda name: "processor")
+
+
+def test_language_model_defaults_to_float32(monkeypatch):
+    monkeypatch.delenv("TEXT_MODEL_DTYPE", raising=False)
+    lm = LanguageModel()
+    assert lm.text_dtype == torch.float32
+    assert lm.model.text_projection.weight.dtype == torch.float32
+
+
+def test_language_model_casts_only_the_text_tower(monkeypatch):
+    monkeypatch.setenv("TEXT_MODEL_DTYPE", "bfloat16")
+    lm = LanguageModel()
+    assert lm.text_dtype == torch.bfloat16
+    assert lm.model.text_projection.weight.dtype == torch.bfloat16
+    # Image embeddings keep being generated in float32
+    assert lm.model.visual_projection.weight.dtype == torch.float32
+    with torch.no_grad():
+        text_features = lm.model.get_text_features(input_ids=torch.tensor([[49406, 320, 49407]]))
+    assert text_features.dtype == torch.bfloat16
+
+
+def test_language_model_rejects_unknown_dtype(monkeypatch):
+    monkeypatch.setenv("TEXT_MODEL_DTYPE", "int4")
+    with pytest.raises(ValueError, match="Unsupported TEXT_MODEL_DTYPE"):
+        LanguageModel()
+
+
+def test_language_model_warmup_runs_a_text_forward():
+    lm = LanguageModel()
+    texts = []
+
+    def processor(text, **kwargs):
+        texts.append(text)
+        return {"input_ids": torch.tensor([[49406, 320, 49407]])}
+
+    lm.processor = processor
+    lm.warmup()
+    assert texts == [["warmup"]]
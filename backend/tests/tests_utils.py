@@ -1,8 +1,61 @@
 """Test utilities for the Conntour Space Explorer backend tests."""
 from typing import List
 
-from app.domain.models import SearchResultHistory, SearchResult
-from app.utils.constants import EMBEDDING_KEY, NORMALIZED_MEDIAN
+import numpy as np
+
+from app.domain.models import SearchResultHistory, SearchResult, Source
+from app.utils.constants import NORMALIZED_MEDIAN
+from app.utils.embedding_utils import top_k_indices
+
+
+# Source metadata shared by every DummyDB; each instance works on its own copies
+_SOURCES = (
+    {
+        "id": 1,
+        "name": "Apollo 11",
+        "type": "Mission",
+        "launch_date": "1969-07-16",
+        "description": "First Moon landing",
+        "image_url": "http://image.com/apollo11.jpg",
+        "status": "Retired",
+    },
+    {
+        "id": 2,
+        "name": "Voyager 1",
+        "type": "Probe",
+        "launch_date": "1977-09-05",
+        "description": "Interstellar probe",
+        "image_url": "http://image.com/voyager1.jpg",
+        "status": "Active",
+    },
+    {
+        "id": 3,
+        "name": "Mars Rover",
+        "type": "Rover",
+        "launch_date": "2020-07-30",
+        "description": "Mars exploration rover",
+        "image_url": "http://image.com/marsrover.jpg",
+        "status": "Active",
+    },
+    {
+        "id": 4,
+        "name": "Hubble Telescope",
+        "type": "Telescope",
+        "launch_date": "1990-04-24",
+        "description": "Space telescope",
+        "image_url": "http://image.com/hubble.jpg",
+        "status": "Active",
+    },
+    {
+        "id": 5,
+        "name": "ISS",
+        "type": "Station",
+        "launch_date": "1998-11-20",
+        "description": "International Space Station",
+        "image_url": "http://image.com/iss.jpg",
+        "status": "Active",
+    },
+)
 
 
 class DummyDB:
@@ -13,98 +66,91 @@ class DummyDB:
         Initialize the DummyDB with test data.
 
         Args:
-            include_embeddings: If True, sources will include embedding data
+            include_embeddings: If True, the first two sources get embeddings
         """
-        self.sources = [
-            {
-                "id": 1,
-                "name": "Apollo 11",
-                "type": "Mission",
-                "launch_date": "1969-07-16",
-                "description": "First Moon landing",
-                "image_url": "http://image.com/apollo11.jpg",
-                "status": "Retired",
-            },
-            {
-                "id": 2,
-                "name": "Voyager 1",
-                "type": "Probe",
-                "launch_date": "1977-09-05",
-                "description": "Interstellar probe",
-                "image_url": "http://image.com/voyager1.jpg",
-                "status": "Active",
-            },
-            {
-                "id": 3,
-                "name": "Mars Rover",
-                "type": "Rover",
-                "launch_date": "2020-07-30",
-                "description": "Mars exploration rover",
-                "image_url": "http://image.com/marsrover.jpg",
-                "status": "Active",
-            },
-            {
-                "id": 4,
-                "name": "Hubble Telescope",
-                "type": "Telescope",
-                "launch_date": "1990-04-24",
-                "description": "Space telescope",
-                "image_url": "http://image.com/hubble.jpg",
-                "status": "Active",
-            },
-            {
-                "id": 5,
-                "name": "ISS",
-                "type": "Station",
-                "launch_date": "1998-11-20",
-                "description": "International Space Station",
-                "image_url": "http://image.com/iss.jpg",
-                "status": "Active",
-            },
-        ]
+        self.sources = [dict(source) for source in _SOURCES]
+        # Index of sources by ID, mirroring SpaceDB
+        self._sources_by_id = {source["id"]: source for source in self.sources}
 
         self.search_results_history = []
+        # Index of search_results_history by ID, mirroring SpaceDB
+        self._history_by_id = {}
+        # Number of full history reads, so tests can check services never scan the whole history
+        self.history_scans = 0
 
+        # Like SpaceDB, embeddings live in one normalized (N, D) matrix whose row i belongs to _embedded_sources[i]
         if include_embeddings:
-            # Add embeddings for search service tests
-            self.sources[0][EMBEDDING_KEY] = [0.2, 0.5, 0.7]
-            self.sources[1][EMBEDDING_KEY] = [0.9, 0.3, 0.4]
+            # Embeddings for search service tests
+            self._embedded_sources = self.sources[:2]
+            embeddings = np.array([[0.2, 0.5, 0.7], [0.9, 0.3, 0.4]], dtype=np.float32)
+            self._emb_matrix = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        else:
+            self._embedded_sources = []
+            self._emb_matrix = np.empty((0, 0), dtype=np.float32)
 
     def get_all_sources(self):
         """Get all sources without embeddings (for SourcesService tests)."""
-        return [
-            {k: v for k, v in source.items() if k != EMBEDDING_KEY}
-            for source in self.sources
-        ]
-
-    def get_all_sources_with_embedding(self):
-        """Get all sources with embeddings (for SearchService tests)."""
-        return self.sources
+        return list(self.sources)
+
+    def get_all_source_models(self):
+        """Get all sources as Source models (for SourcesService tests)."""
+        return [Source(**source) for source in self.get_all_sources()]
+
+    def get_embedded_sources(self):
+        """Get the sources that have an embedding, without embeddings (for SearchService tests)."""
+        return list(self._embedded_sources)
+
+    def score_all(self, text_vec):
+        """Get the cosine similarity of each embedded source to a text vector (for SearchService tests)."""
+        if len(self._emb_matrix) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self._emb_matrix @ text_vec
+
+    def search_by_embedding(self, text_vec, limit):
+        """Get the top scores, their positions and the lowest score (for SearchService tests)."""
+        scores = self.score_all(text_vec)
+        if len(scores) == 0:
+            return scores, np.empty(0, dtype=np.intp), 0.0
+        top_indices = top_k_indices(scores, limit)
+        return scores[top_indices], top_indices, float(scores.min())
 
     def get_sources_by_ids(self, source_ids):
-        """Get sources by their IDs (without embeddings).
+        """Get sources by their IDs.
         
         Args:
             source_ids: List of source IDs to retrieve.
             
         Returns:
-            Dictionary mapping source ID to source dict (without embeddings).
+            Dictionary mapping source ID to its Source model.
         """
-        sources_dict = {}
-        for source in self.sources:
-            source_id = source.get("id")
-            if source_id in source_ids:
-                source_clean = {k: v for k, v in source.items() if k != EMBEDDING_KEY}
-                sources_dict[source_id] = source_clean
-        return sources_dict
+        return {
+            source_id: Source(**self._sources_by_id[source_id])
+            for source_id in source_ids if source_id in self._sources_by_id
+        }
 
     def get_all_search_results_history(self):
         """Get all search results history (for SearchService tests)."""
+        self.history_scans += 1
         return self.search_results_history
 
     def add_search_result_history(self, search_result_history: SearchResultHistory):
-        """Add a new search result history (for SearchService tests)."""
+        """Add a new search result history, keeping history ordered by time searched (for SearchService tests)."""
         self.search_results_history.append(search_result_history)
+        self.search_results_history.sort(key=lambda item: item.sort_key)
+        self._history_by_id[search_result_history.id] = search_result_history
+
+    def count_search_results_history(self):
+        """Get the number of search history results (for HistoryService tests)."""
+        return len(self.search_results_history)
+
+    def get_search_results_history_page(self, start_index, limit):
+        """Get a page of history items, most recent first (for HistoryService tests)."""
+        return self.search_results_history[::-1][start_index:start_index + limit]
+
+    def get_search_results_history_before(self, key, limit):
+        """Get up to `limit` history items before a (time_searched, id) key, most recent first (for HistoryService tests)."""
+        older = [item for item in self.search_results_history if key is None or item.sort_key < key]
+        return older[::-1][:limit]
 
     def get_search_result_history_by_id(self, history_id: str) -> SearchResultHistory:
         """Get a search result history by ID (for HistoryService tests).
@@ -118,10 +164,9 @@ class DummyDB:
         Raises:
             ValueError: If the history item is not found.
         """
-        for item in self.search_results_history:
-            if item.id == history_id:
-                return item
-        raise ValueError(f"History item with ID {history_id} not found")
+        if history_id not in self._history_by_id:
+            raise ValueError(f"History item with ID {history_id} not found")
+        return self._history_by_id[history_id]
 
     def delete_search_result_history(self, history_id: str) -> bool:
         """Delete a search result history by ID (for HistoryService tests).
@@ -132,11 +177,11 @@ class DummyDB:
         Returns:
             True if the item was found and deleted, False otherwise.
         """
-        initial_length = len(self.search_results_history)
-        self.search_results_history = [
-            item for item in self.search_results_history if item.id != history_id
-        ]
-        return len(self.search_results_history) < initial_length
+        item = self._history_by_id.pop(history_id, None)
+        if item is None:
+            return False
+        self.search_results_history.remove(item)
+        return True
 
 
 class DummyLM:
@@ -0,0 +1,54 @@
+import pytest
+
+from app.utils.cache_utils import LRUCache
+
+
+def test_lru_cache_get_and_put():
+    """Test that cached values are returned and missing keys return None."""
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert len(cache) == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the least recently used entry is evicted when the cache is full."""
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_cache_tracks_hit_ratio():
+    cache = LRUCache(max_size=2)
+    assert cache.hit_ratio == 0.0
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_ratio == pytest.approx(2 / 3)
+
+
+def test_lru_cache_clear():
+    """Test that clear removes every entry."""
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.clear()
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_rejects_invalid_size():
+    """Test that a cache must hold at least one entry."""
+    with pytest.raises(ValueError):
+        LRUCache(max_size=0)
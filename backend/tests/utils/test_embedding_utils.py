@@ -1,38 +1,34 @@
 import os
+import pickle
+from io import BytesIO
 
 import numpy as np
+import pytest
+import torch
+from PIL import Image
 
 from app.utils import embedding_utils
 
 
 def test_check_for_cached_embeddings_returns_none_when_no_cache(tmp_path, monkeypatch):
     """Test that check_for_cached_embeddings returns cache_path and None when no cache exists."""
-    dummy_path = tmp_path / "not_exist.json"
-    dummy_path.touch()  # Create the file so data_path exists
+    # Look for the cache in tmp_path
+    monkeypatch.setattr(embedding_utils, "_cache_dir", str(tmp_path))
 
-    # Patch the cache path construction to use tmp_path
-    original_dirname = os.path.dirname
-
-    def mock_dirname(path):
-        if "embedding_utils.py" in str(path) or path == embedding_utils.__file__:
-            return str(tmp_path)
-        return original_dirname(path)
-
-    monkeypatch.setattr(os.path, "dirname", mock_dirname)
-
-    cache_path, cached_embeddings = embedding_utils.check_for_cached_embeddings(str(dummy_path))
-    assert cache_path is not None
-    assert isinstance(cache_path, str)
+    cache_path, cached_embeddings = embedding_utils.check_for_cached_embeddings()
+    assert cache_path == os.path.join(str(tmp_path), embedding_utils.EMBEDDING_CACHE)
     assert cached_embeddings is None
 
 
 def test_save_and_load_embeddings_cache(tmp_path):
     """Test saving and loading embeddings cache."""
+    key_1 = embedding_utils.get_embedding_cache_key("http://img1.jpg")
+    key_2 = embedding_utils.get_embedding_cache_key("http://img2.jpg")
     embeddings_dict = {
-        1: np.array([1.1, 2.2, 3.3], dtype=np.float32),
-        2: np.array([4.4, 5.5, 6.6], dtype=np.float32),
+        key_1: np.array([1.1, 2.2, 3.3], dtype=np.float32),
+        key_2: np.array([4.4, 5.5, 6.6], dtype=np.float32),
     }
-    cache_path = str(tmp_path / "cache.pkl")
+    cache_path = str(tmp_path / "cache.npy")
 
     # Save embeddings
     embedding_utils.save_embeddings_cache(embeddings_dict, cache_path)
@@ -42,34 +38,149 @@ def test_save_and_load_embeddings_cache(tmp_path):
 
     assert loaded_embeddings is not None
     assert len(loaded_embeddings) == 2
-    assert 1 in loaded_embeddings
-    assert 2 in loaded_embeddings
-    np.testing.assert_allclose(embeddings_dict[1], loaded_embeddings[1])
-    np.testing.assert_allclose(embeddings_dict[2], loaded_embeddings[2])
+    assert key_1 in loaded_embeddings
+    assert key_2 in loaded_embeddings
+    np.testing.assert_allclose(embeddings_dict[key_1], loaded_embeddings[key_1])
+    np.testing.assert_allclose(embeddings_dict[key_2], loaded_embeddings[key_2])
+    # Embeddings are read-only views into the memory-mapped file
+    assert not loaded_embeddings[key_1].flags.writeable
 
 
-def test_get_image_embedding_from_cache():
-    """Test that get_image_embedding returns cached embedding when available."""
-    cached_embeddings = {
-        1: np.array([0.1, 0.2, 0.3], dtype=np.float32)
-    }
+def test_get_embeddings_from_image_urls_embeds_batch_in_one_pass(monkeypatch):
+    """Test that a batch of images is embedded in one forward pass, in image URL order."""
+    monkeypatch.setattr(embedding_utils, "download_image", lambda image_url: image_url)
+
+    def processor(images, return_tensors):
+        return {"pixel_values": torch.tensor([[float(image[-5])] for image in images])}
+
+    forward_passes = []
+
+    class Model:
+        def get_image_features(self, pixel_values):
+            forward_passes.append(len(pixel_values))
+            return pixel_values.repeat(1, 2)
+
+    image_urls = ["http://img1.jpg", "http://img2.jpg", "http://img3.jpg"]
+    result = embedding_utils.get_embeddings_from_image_urls(Model(), processor, image_urls)
+
+    assert forward_passes == [3]
+    np.testing.assert_allclose(result, [[1.0, 1.0], [2.0, 2.0], [3.0, 3.0]])
+
+
+def test_download_image_decodes_body_from_shared_session(monkeypatch):
+    """Test that images are downloaded through the shared session with a timeout and decoded as RGB."""
+    image_bytes = BytesIO()
+    Image.new("L", (4, 3)).save(image_bytes, format="PNG")
+    requested = []
+
+    class Response:
+        content = image_bytes.getvalue()
+
+        def raise_for_status(self):
+            pass
+
+    def get(image_url, **kwargs):
+        requested.append((image_url, kwargs["timeout"]))
+        return Response()
+
+    monkeypatch.setattr(embedding_utils._http_session, "get", get)
+    image = embedding_utils.download_image("http://img.jpg")
+
+    assert requested == [("http://img.jpg", embedding_utils.IMAGE_DOWNLOAD_TIMEOUT)]
+    assert image.mode == "RGB"
+    assert image.size == (4, 3)
+
+
+def test_normalize_embedding():
+    """Test that normalize_embedding scales to unit length and leaves zero vectors alone."""
+    result = embedding_utils.normalize_embedding(np.array([[3.0, 4.0]]))
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, [0.6, 0.8], rtol=1e-6)
+    np.testing.assert_array_equal(embedding_utils.normalize_embedding(np.zeros(2)), [0.0, 0.0])
+
+
+def test_calculate_image_and_text_similarity():
+    """Test that the similarity is the cosine of the angle between the vectors, whatever their lengths."""
+    image_vec = np.array([3.0, 4.0], dtype=np.float32)
+    assert embedding_utils.calculate_image_and_text_similarity(image_vec, np.array([6.0, 8.0])) == pytest.approx(1.0)
+    assert embedding_utils.calculate_image_and_text_similarity(image_vec, np.array([4.0, -3.0])) == pytest.approx(0.0)
+
+
+def test_quantize_int8_per_row_scales():
+    """Test that quantize_int8 keeps one scale per row and round-trips within half a quantization step."""
+    matrix = np.array([[0.6, -0.8, 0.0], [0.0, 0.0, 0.0]], dtype=np.float32)
+    quantized, scales = embedding_utils.quantize_int8(matrix)
+    assert quantized.dtype == np.int8
+    assert scales.shape == (2,)
+    assert quantized[0].tolist() == [95, -127, 0]
+    np.testing.assert_allclose(quantized[0] * scales[0], matrix[0], atol=scales[0] / 2)
+    # All-zero rows stay zero
+    assert quantized[1].tolist() == [0, 0, 0]
+
+
+def test_load_embeddings_cache_normalizes_legacy_cache(tmp_path):
+    """Test that a pickled cache is normalized and keeps its source index keys."""
+    cache_path = str(tmp_path / "cache.pkl")
+    with open(cache_path, "wb") as f:
+        pickle.dump({1: np.array([3.0, 4.0], dtype=np.float32)}, f)
+
+    loaded_embeddings = embedding_utils.load_legacy_embeddings_cache(cache_path)
+    assert list(loaded_embeddings.keys()) == [1]
+    np.testing.assert_allclose(loaded_embeddings[1], [0.6, 0.8], rtol=1e-6)
+
+
+def test_save_embeddings_cache_writes_npy_atomically(tmp_path):
+    """Test that the cache is written as a .npy record array and no temporary file is left behind."""
+    cache_path = str(tmp_path / "cache.npy")
+    key = embedding_utils.get_embedding_cache_key("http://img.jpg")
+    embedding_utils.save_embeddings_cache({key: np.array([0.6, 0.8], dtype=np.float32)}, cache_path)
+
+    assert os.listdir(tmp_path) == ["cache.npy"]
+    records = np.load(cache_path, allow_pickle=False)
+    assert records["key"].astype(str).tolist() == [key]
+    assert records["embedding"].dtype == np.float32
+
+
+def test_get_embedding_cache_key_depends_only_on_url():
+    """Test that cache keys are stable per image URL."""
+    key = embedding_utils.get_embedding_cache_key("http://img.jpg")
+    assert key == embedding_utils.get_embedding_cache_key("http://img.jpg")
+    assert key != embedding_utils.get_embedding_cache_key("http://other.jpg")
+
+
+def test_load_embeddings_cache_ignores_unknown_layout(tmp_path):
+    """Test that a .npy file that isn't a cache record array is not used."""
+    cache_path = str(tmp_path / "cache.npy")
+    np.save(cache_path, np.zeros((2, 3), dtype=np.float32))
+
+    assert embedding_utils.load_embeddings_cache(cache_path) is None
+
+
+def test_load_legacy_embeddings_cache_ignores_unknown_format(tmp_path):
+    """Test that a pickle that doesn't map source indices to embeddings is not used."""
+    cache_path = str(tmp_path / "cache.pkl")
+    with open(cache_path, "wb") as f:
+        pickle.dump({"http://img.jpg": np.array([0.6, 0.8])}, f)
 
-    result = embedding_utils.get_image_embedding("model", "processor", cached_embeddings, 1, "http://img.jpg")
+    assert embedding_utils.load_legacy_embeddings_cache(cache_path) is None
 
-    assert isinstance(result, np.ndarray)
-    np.testing.assert_allclose(result, np.array([0.1, 0.2, 0.3], dtype=np.float32))
 
+def test_check_for_cached_embeddings_falls_back_to_legacy_cache(tmp_path, monkeypatch):
+    """Test that a pickled cache is used when there is no .npy cache yet."""
+    monkeypatch.setattr(embedding_utils, "EMBEDDING_CACHE", str(tmp_path / "cache.npy"))
+    monkeypatch.setattr(embedding_utils, "LEGACY_EMBEDDING_CACHE", str(tmp_path / "cache.pkl"))
+    with open(tmp_path / "cache.pkl", "wb") as f:
+        pickle.dump({1: np.array([3.0, 4.0])}, f)
 
-def test_get_image_embedding_generates_new(monkeypatch):
-    """Test that get_image_embedding generates new embedding when not in cache."""
-    # Patch get_embedding_from_image_url to return a dummy embedding
-    monkeypatch.setattr(
-        embedding_utils,
-        "get_embedding_from_image_url",
-        lambda *a, **kw: np.array([0.4, 0.5, 0.6], dtype=np.float32)
-    )
+    cache_path, cached_embeddings = embedding_utils.check_for_cached_embeddings()
+    assert cache_path == str(tmp_path / "cache.npy")
+    assert list(cached_embeddings) == [1]
+    np.testing.assert_allclose(cached_embeddings[1], [0.6, 0.8], rtol=1e-6)
 
-    result = embedding_utils.get_image_embedding("model", "processor", None, 0, "http://img.jpg")
 
-    assert isinstance(result, np.ndarray)
-    np.testing.assert_allclose(result, np.array([0.4, 0.5, 0.6], dtype=np.float32))
+def test_top_k_indices_returns_highest_scores_first():
+    scores = np.array([0.3, 0.9, 0.1, 0.7, 0.5])
+    assert embedding_utils.top_k_indices(scores, 3).tolist() == [1, 3, 4]
+    # k larger than the number of scores returns every index
+    assert embedding_utils.top_k_indices(scores, 10).tolist() == [1, 3, 4, 0, 2]
+    assert embedding_utils.top_k_indices(np.array([]), 3).tolist() == []
@@ -32,5 +32,6 @@ export interface SearchResultHistoryResponse {
 export interface HistoryResponse {
   items: SearchResultHistoryResponse[];
   total: number;
+  next_cursor?: string | null;
 }
 